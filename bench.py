@@ -0,0 +1,413 @@
+"""Benchmark offline bot.py: handler `dp` asli dijalanin lawan fake Bot API lokal (aiohttp).
+
+Contoh:
+    python bench.py --scenario all --output bench.json
+    python bench.py --scenario start --updates 5000 --latency 40 --rate-429 0.01
+
+Hasil JSON (stdout / --output) bisa dibandingin antar versi.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from aiohttp import ClientSession, web
+
+BENCH_TOKEN = "123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH"
+OWNER_ID = 1
+# User id >= UNJOINED_FROM dianggep belum join channel FSUB
+UNJOINED_FROM = 5_000_000
+FSUB_CHANNELS = "@bench1 @bench2 @bench3 @bench4"
+
+# ================= FAKE BOT API =================
+class FakeTelegramAPI:
+    """Stand-in Bot API: latency bisa diatur & sebagian request dijawab 429."""
+
+    def __init__(self, latency_ms: float = 0, rate_429: float = 0, retry_after: int = 1):
+        self.latency = latency_ms / 1000
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.throttled = 0
+        self._message_id = 0
+        self._runner = None
+        self._loop = None
+        self._thread = None
+
+    def _message(self, data):
+        self._message_id += 1
+        chat_id = data.get("chat_id", "0")
+        chat_id = int(chat_id) if chat_id.lstrip("-").isdigit() else -100
+        return {"message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"}, "text": data.get("text", "")}
+
+    def _result(self, method, data):
+        if method == "getMe":
+            return {"id": int(BENCH_TOKEN.split(":")[0]), "is_bot": True, "first_name": "Bench", "username": "benchbot"}
+        if method == "getChatMember":
+            user_id = int(data["user_id"])
+            status = "left" if user_id >= UNJOINED_FROM else "member"
+            return {"status": status, "user": {"id": user_id, "is_bot": False, "first_name": "U"}}
+        if method == "sendMediaGroup":
+            return [self._message(data) for _ in json.loads(data["media"])]
+        if method == "copyMessage":
+            self._message_id += 1
+            return {"message_id": self._message_id}
+        if method.startswith("send") or method.startswith("edit"):
+            return self._message(data)
+        return True
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        data = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency: await asyncio.sleep(self.latency)
+        if self.rate_429 and random.random() < self.rate_429:
+            self.throttled += 1
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {self.retry_after}",
+                                      "parameters": {"retry_after": self.retry_after}}, status=429)
+        return web.json_response({"ok": True, "result": self._result(method, data)})
+
+    def start(self, host: str, port: int):
+        """Server jalan di thread + event loop sendiri biar ga ikut ngukur beban fake API."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def serve():
+            app = web.Application()
+            app.router.add_post("/bot{token}/{method}", self.handle)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, host, port).start()
+            started.set()
+
+        def target():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(serve())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if not self._runner: return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+# ================= HELPER =================
+def percentile(values, pct):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def peak_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def git_version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+def user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"}
+
+def message_update(update_id, user_id, **fields):
+    msg = {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+           "from": user(user_id)}
+    msg.update(fields)
+    return {"update_id": update_id, "message": msg}
+
+def start_update(update_id, user_id, code):
+    text = f"/start {code}"
+    return message_update(update_id, user_id, text=text, entities=[{"type": "bot_command", "offset": 0, "length": 6}])
+
+def callback_update(update_id, user_id, data):
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "bench", "from": user(user_id), "data": data,
+        "message": {"message_id": update_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+                    "text": "bench"}}}
+
+def photo_update(update_id, user_id, group_id):
+    fid = f"photo{update_id}"
+    return message_update(update_id, user_id, media_group_id=group_id,
+                          photo=[{"file_id": fid, "file_unique_id": fid, "width": 1, "height": 1}])
+
+class Bench:
+    def __init__(self, bot_module, api: FakeTelegramAPI, concurrency: int):
+        self.b = bot_module
+        self.api = api
+        self.concurrency = concurrency
+        self._next_update = 0
+
+    def next_id(self):
+        self._next_update += 1
+        return self._next_update
+
+    def _instrument_db(self):
+        """Hitung berapa kali & berapa lama nunggu lock writer / reader pool."""
+        db = self.b.database
+        stats = {"waits": 0, "wait_s": 0.0}
+        write, read = db.write, db.read
+
+        @asynccontextmanager
+        async def timed(ctx_factory, busy):
+            t0 = time.perf_counter()
+            contended = busy()
+            async with ctx_factory() as conn:
+                if contended:
+                    stats["waits"] += 1
+                    stats["wait_s"] += time.perf_counter() - t0
+                yield conn
+
+        db.write = lambda: timed(write, db._write_lock.locked)
+        db.read = lambda: timed(read, db._readers.empty)
+        return stats
+
+    async def feed(self, updates):
+        """Jalanin semua update lewat dp.feed_update (maks `concurrency` barengan), catat latency."""
+        Update = self.b.Update
+        sem = asyncio.Semaphore(self.concurrency)
+        latencies, errors = [], Counter()
+
+        async def one(raw):
+            update = Update.model_validate(raw, context={"bot": self.b.bot})
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    await self.b.dp.feed_update(self.b.bot, update)
+                except Exception as e:
+                    errors[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - t0)
+
+        await asyncio.gather(*(one(raw) for raw in updates))
+        return latencies, errors
+
+    def _dropped(self):
+        """Update yang dibuang flood control (duplikat / kebanyakan)."""
+        return sum(v for (name, _), v in self.b.metrics.counters.items() if name == "bot_updates_dropped_total")
+
+    async def measure(self, name, coro_factory):
+        self.api.calls.clear()
+        self.api.throttled = 0
+        db_stats = self._instrument_db()
+        dropped = self._dropped()
+        t0 = time.perf_counter()
+        latencies, errors, updates = await coro_factory()
+        duration = time.perf_counter() - t0
+        del self.b.database.write, self.b.database.read
+        result = {
+            "updates": updates,
+            "errors": dict(errors),
+            "duration_s": round(duration, 4),
+            "updates_per_s": round(updates / duration, 2) if duration else 0.0,
+            "latency_ms": {p: round(percentile(latencies, q) * 1000, 3)
+                           for p, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))},
+            "updates_dropped": self._dropped() - dropped,
+            "db_lock_waits": db_stats["waits"],
+            "db_lock_wait_ms": round(db_stats["wait_s"] * 1000, 3),
+            "api_calls": dict(self.api.calls),
+            "api_429": self.api.throttled,
+            "peak_rss_kb": peak_rss_kb(),
+        }
+        print(f"[{name}] {updates} update, {result['updates_per_s']}/s, p50={result['latency_ms']['p50']}ms "
+              f"p95={result['latency_ms']['p95']}ms p99={result['latency_ms']['p99']}ms, "
+              f"lock wait={result['db_lock_waits']}, err={sum(errors.values())}", file=sys.stderr)
+        return result
+
+    # ================= SCENARIOS =================
+    async def _media_codes(self, count):
+        codes = [f"bench{i:06d}" for i in range(count)]
+        async with self.b.database.write() as db:
+            await db.executemany("INSERT OR IGNORE INTO media (code, file_id, type, caption) VALUES (?, ?, ?, ?)",
+                                 [(c, f"file{c}", "video", "bench") for c in codes])
+        return codes
+
+    async def scenario_start(self, args):
+        """Storm /start deep link dari user berbeda, FSUB 4 channel aktif."""
+        await self.b.set_config("fsub_channels", FSUB_CHANNELS)
+        codes = await self._media_codes(50)
+        updates = [start_update(self.next_id(), 1_000_000 + i, random.choice(codes)) for i in range(args.updates)]
+        latencies, errors = await self.feed(updates)
+        return latencies, errors, len(updates)
+
+    async def scenario_check_sub(self, args):
+        """User yang belum join mencet "COBA LAGI" berulang-ulang."""
+        await self.b.set_config("fsub_channels", FSUB_CHANNELS)
+        codes = await self._media_codes(50)
+        users = [UNJOINED_FROM + i for i in range(max(1, args.updates // args.retries))]
+        updates = [callback_update(self.next_id(), u, f"check_sub:{random.choice(codes)}")
+                   for _ in range(args.retries) for u in users]
+        latencies, errors = await self.feed(updates)
+        return latencies, errors, len(updates)
+
+    async def scenario_series(self, args):
+        """/start deep link seri (s_<kode>): semua part dikirim pake sendMediaGroup isi 10."""
+        codes = await self._media_codes(args.parts)
+        token = self.b.current_tenant.set(self.b.main_tenant)
+        try: post = await self.b.save_post(codes, "Bench")
+        finally: self.b.current_tenant.reset(token)
+        updates = [start_update(self.next_id(), 4_000_000 + i, f"s_{post}") for i in range(args.updates)]
+        latencies, errors = await self.feed(updates)
+        return latencies, errors, len(updates)
+
+    async def scenario_upload(self, args):
+        """Admin upload album multi-part: album -> pilih judul -> post ke channel."""
+        await self.b.set_config("channel_post", "@benchchannel")
+        admins = [OWNER_ID] + [100 + i for i in range(args.admins - 1)]
+        async with self.b.database.write() as db:
+            await db.executemany("INSERT OR IGNORE INTO admins (admin_id) VALUES (?)", [(a,) for a in admins[1:]])
+            async with db.execute("INSERT INTO titles (title) VALUES ('Bench')") as cur: title_id = cur.lastrowid
+        self.b.cache.clear()
+        self.b.albums.window = args.album_window
+        all_latencies, all_errors, total = [], Counter(), 0
+        for round_no in range(args.upload_rounds):
+            albums = [photo_update(self.next_id(), a, f"g{round_no}-{a}") for a in admins for _ in range(args.parts)]
+            for step in (albums,
+                         [callback_update(self.next_id(), a, f"t_sel:{title_id}") for a in admins],
+                         [callback_update(self.next_id(), a, "final_post") for a in admins]):
+                latencies, errors = await self.feed(step)
+                all_latencies += latencies
+                all_errors += errors
+                total += len(step)
+        return all_latencies, all_errors, total
+
+    async def scenario_broadcast(self, args):
+        """Broadcast ke banyak user lewat engine broadcast (throughput engine, bukan limit Telegram)."""
+        async with self.b.database.write() as db:
+            await db.executemany("INSERT OR IGNORE INTO users (user_id) VALUES (?)",
+                                 [(2_000_000 + i,) for i in range(args.users)])
+        broadcaster = self.b.broadcaster
+        broadcaster.rate = args.broadcast_rate
+        broadcaster.buckets.clear()
+        # Satu "update" = satu user yang diproses; latency = waktu kirim ke satu user
+        latencies, deliver = [], broadcaster._deliver
+
+        async def timed_deliver(job, user_id):
+            t0 = time.perf_counter()
+            try: return await deliver(job, user_id)
+            finally: latencies.append(time.perf_counter() - t0)
+
+        broadcaster._deliver = timed_deliver
+        try:
+            job_id = await broadcaster.start_job(self.b.MAIN_TENANT_ID, OWNER_ID, 1, OWNER_ID, 2)
+            await broadcaster.tasks[job_id]
+        finally:
+            del broadcaster._deliver
+        job = await broadcaster.get_job(job_id)
+        errors = Counter({"failed": job["failed"]}) if job["failed"] else Counter()
+        return latencies, errors, job["sent"] + job["failed"] + job["blocked"]
+
+    async def scenario_payment(self, args):
+        """Fake payment provider: burst callback QRIS (tiap invoice dikirim dobel) ke endpoint payment."""
+        price, payments = 10_000, self.b.payments
+        invoices = [(f"BENCH{i:07d}", 3_000_000 + i) for i in range(args.invoices)]
+        async with self.b.database.write() as db:
+            await db.executemany("INSERT INTO invoices (id, user_id, bot_id, amount, status) VALUES (?, ?, '0', ?, 'pending')",
+                                 [(inv, uid, price) for inv, uid in invoices])
+        callbacks = [inv for inv, _ in invoices for _ in range(args.payment_dupes)]
+        random.shuffle(callbacks)
+        url = f"http://127.0.0.1:{args.payment_port}{payments.path}"
+        sem = asyncio.Semaphore(self.concurrency)
+        latencies, errors = [], Counter()
+
+        async def one(http, invoice_id):
+            async with sem:
+                t0 = time.perf_counter()
+                body = json.dumps({"invoice_id": invoice_id, "status": "settlement", "amount": price}).encode()
+                headers = {"Content-Type": "application/json", payments.SIGNATURE_HEADER: payments.sign(body)}
+                async with http.post(url, data=body, headers=headers) as resp:
+                    if resp.status != 200: errors[f"http_{resp.status}"] += 1
+                latencies.append(time.perf_counter() - t0)
+
+        payments.secret = payments.secret or "bench-secret"
+        await payments.start("127.0.0.1", args.payment_port)
+        try:
+            async with ClientSession() as http:
+                await asyncio.gather(*(one(http, inv) for inv in callbacks))
+            # Latency = waktu ack; durasi total nunggu sampe semua callback selesai diproses
+            await payments.queue.join()
+        finally:
+            await payments.stop()
+        paid = (await self.b.database.fetchone("SELECT COUNT(*) FROM invoices WHERE id LIKE 'BENCH%' AND status='paid'"))[0]
+        if paid != len(invoices): errors["not_paid"] += len(invoices) - paid
+        return latencies, errors, len(callbacks)
+
+SCENARIOS = ("start", "check_sub", "series", "upload", "broadcast", "payment")
+
+async def run(args):
+    api = FakeTelegramAPI(args.latency, args.rate_429, args.retry_after)
+    api.start("127.0.0.1", args.port)
+    workdir = tempfile.mkdtemp(prefix="botbench-")
+    os.environ.update({"BOT_TOKEN": BENCH_TOKEN, "ADMIN_ID": str(OWNER_ID),
+                       "BOT_API_URL": f"http://127.0.0.1:{args.port}", "DB_PATH": os.path.join(workdir, "bench.db")})
+    bot_module = importlib.import_module("bot")
+    # Fake API ga punya limit; default limiter dimatiin biar yang keukur throughput kodenya
+    bot_module.rate_limiter.global_rate = args.api_rate
+    await bot_module.database.start()
+    await bot_module.migrate_db()
+    await bot_module.user_registry.start()
+    bench = Bench(bot_module, api, args.concurrency)
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    report = {"version": git_version(), "python": sys.version.split()[0], "params": vars(args), "scenarios": {}}
+    try:
+        for name in scenarios:
+            report["scenarios"][name] = await bench.measure(name, lambda: getattr(bench, f"scenario_{name}")(args))
+    finally:
+        await bot_module.broadcaster.stop()
+        await bot_module.user_registry.stop()
+        await bot_module.database.close()
+        await bot_module.bot.session.close()
+        api.stop()
+    return report
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Load test offline bot.py pakai fake Bot API.")
+    p.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    p.add_argument("--updates", type=int, default=2000, help="jumlah update buat skenario start/check_sub")
+    p.add_argument("--retries", type=int, default=5, help="berapa kali tiap user mencet COBA LAGI")
+    p.add_argument("--admins", type=int, default=3)
+    p.add_argument("--parts", type=int, default=10, help="jumlah part per album / seri")
+    p.add_argument("--upload-rounds", type=int, default=5)
+    p.add_argument("--album-window", type=float, default=1.0)
+    p.add_argument("--users", type=int, default=100_000, help="jumlah user buat skenario broadcast")
+    p.add_argument("--broadcast-rate", type=float, default=5000, help="token/detik bucket broadcast")
+    p.add_argument("--invoices", type=int, default=2000, help="jumlah invoice buat skenario payment")
+    p.add_argument("--payment-dupes", type=int, default=3, help="berapa kali tiap callback dikirim ulang provider")
+    p.add_argument("--payment-port", type=int, default=8098)
+    p.add_argument("--concurrency", type=int, default=100, help="maks update diproses barengan")
+    p.add_argument("--latency", type=float, default=30, help="latency fake API (ms)")
+    p.add_argument("--rate-429", type=float, default=0.0, help="peluang request dijawab 429")
+    p.add_argument("--retry-after", type=int, default=1)
+    p.add_argument("--api-rate", type=float, default=0, help="limit global kirim pesan/detik (0 = limiter mati)")
+    p.add_argument("--port", type=int, default=8099)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--output", help="tulis JSON ke file ini (default stdout)")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    report = asyncio.run(run(args))
+    out = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f: f.write(out + "\n")
+    else:
+        print(out)
+
+if __name__ == "__main__":
+    main()
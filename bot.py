@@ -1,18 +1,42 @@
-ini kode py ku, import asyncio
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
 import uuid
 import os
+import re
+import secrets
+import shutil
+import signal
+import sqlite3
+import tempfile
+import time
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 import aiosqlite
-from aiogram import Bot, Dispatcher, F
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter, TelegramUnauthorizedError
 from aiogram.types import (
     Message, InlineKeyboardMarkup, InlineKeyboardButton, 
-    FSInputFile, CallbackQuery
+    FSInputFile, CallbackQuery, ChatMemberUpdated, Update,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent, InputMediaPhoto, InputMediaVideo
 )
 from aiogram.filters import CommandStart, Command, StateFilter
+from aiogram.methods import GetUpdates
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.utils.formatting import Bold, Text
 
 # ================= KONFIGURASI =================
 BOT_TOKEN = os.getenv("BOT_TOKEN")
@@ -21,10 +45,87 @@ try:
 except (TypeError, ValueError):
     OWNER_ID = 0
 
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
-dp = Dispatcher(storage=MemoryStorage())
+# Webhook: isi WEBHOOK_URL (URL publik) buat pindah dari polling ke webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Kosong = dibikin acak tiap start (set_webhook selalu dipanggil ulang, jadi Telegram ikut pake yang baru)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+# Endpoint /metrics (Prometheus) cuma di localhost; METRICS_PORT=0 buat matiin
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Endpoint callback payment gateway (QRIS); PAYMENT_PORT=0 buat matiin, tanpa PAYMENT_SECRET ga dinyalain
+PAYMENT_HOST = os.getenv("PAYMENT_HOST", "127.0.0.1")
+PAYMENT_PORT = int(os.getenv("PAYMENT_PORT", "8081"))
+PAYMENT_PATH = os.getenv("PAYMENT_PATH", "/payment/callback")
+PAYMENT_SECRET = os.getenv("PAYMENT_SECRET")
+PAYMENT_QUEUE_SIZE = int(os.getenv("PAYMENT_QUEUE_SIZE", "10000"))
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "4"))
+# Limit kirim pesan ke Bot API (pesan/detik); API_GLOBAL_RATE=0 buat matiin
+API_GLOBAL_RATE = float(os.getenv("API_GLOBAL_RATE", "30"))
+API_CHAT_RATE = float(os.getenv("API_CHAT_RATE", "1"))
+API_GROUP_RATE = float(os.getenv("API_GROUP_RATE", str(20 / 60)))
+# Flood control update masuk per user; THROTTLE_RATE=0 buat matiin
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+DUPLICATE_WINDOW = float(os.getenv("DUPLICATE_WINDOW", "2"))
+# Base URL Bot API lain (local bot-api server / fake API buat testing)
+BOT_API_URL = os.getenv("BOT_API_URL")
+
+log = logging.getLogger("bot")
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL) if BOT_API_URL else PRODUCTION)
+bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_NAME = os.path.join(BASE_DIR, "media.db")
+DB_NAME = os.getenv("DB_PATH") or os.path.join(BASE_DIR, "media.db")
+# Seberapa sering tabel clone_bots dicek ulang (detik)
+CLONE_SYNC_INTERVAL = int(os.getenv("CLONE_SYNC_INTERVAL", "60"))
+
+# ================= TENANT =================
+class Tenant:
+    """Satu bot yang dilayani proses ini. `id` = scope data di DB (0 = bot utama, clone = id bot Telegram)."""
+    __slots__ = ("id", "bot", "owner_id")
+
+    def __init__(self, id: int, bot: Bot, owner_id: int):
+        self.id = id
+        self.bot = bot
+        self.owner_id = owner_id
+
+MAIN_TENANT_ID = 0
+main_tenant = Tenant(MAIN_TENANT_ID, bot, OWNER_ID)
+# Semua bot aktif: scope id -> Tenant
+tenants = {MAIN_TENANT_ID: main_tenant}
+current_tenant = ContextVar("current_tenant", default=main_tenant)
+
+def tenant():
+    return current_tenant.get()
+
+def tenant_for_bot(b: Bot):
+    if b is bot: return main_tenant
+    return tenants.get(b.id)
+
+class TenantMiddleware(BaseMiddleware):
+    """Set tenant aktif dari bot yang nerima update; update buat bot yang udah dicopot dibuang."""
+
+    async def __call__(self, handler, event, data):
+        t = tenant_for_bot(data["bot"])
+        if t is None: return None
+        token = current_tenant.set(t)
+        try:
+            return await handler(event, data)
+        finally:
+            current_tenant.reset(token)
+
+def is_owner(event):
+    """Filter handler: cuma owner bot yang lagi dipake."""
+    return event.from_user.id == tenant().owner_id
+
+def is_main_owner(event):
+    """Filter handler: owner bot utama (operasi yang nyentuh seluruh DB)."""
+    return tenant() is main_tenant and event.from_user.id == OWNER_ID
 
 # ================= STATES =================
 class AdminStates(StatesGroup):
@@ -37,6 +138,7 @@ class AdminStates(StatesGroup):
     waiting_for_preview = State()
     waiting_for_cover = State()
     waiting_for_add_title = State()
+    waiting_for_vip_price = State()
 
 class MemberStates(StatesGroup):
     waiting_for_ask = State()
@@ -47,101 +149,1037 @@ class PostMedia(StatesGroup):
     waiting_for_post_title = State()
     waiting_for_final_confirm = State()
 
+# ================= RATE LIMIT =================
+class TokenBucket:
+    """Token bucket async: isi `rate` token per detik, burst maksimal `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        # capacity < 1 bikin acquire ga pernah dapet token (rate < 1, mis. grup 20/60)
+        self.capacity = max(1, capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stop semua pengirim selama `seconds` (dipake pas kena 429 retry_after)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """Versi non-blocking: ambil 1 token kalau ada, ga pake nunggu."""
+        now = time.monotonic()
+        if now < self._paused_until: return False
+        self._refill(now)
+        if self._tokens < 1: return False
+        self._tokens -= 1
+        return True
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Limit call kirim pesan ke Bot API (global per bot + per chat) di level session, retry otomatis kalau kena 429."""
+
+    MAX_RETRIES = 3
+    SEND_PREFIXES = ("send", "copy", "forward")
+    # Dipanggil tiap update (cek fsub): ga dilimit, tapi 429-nya tetep ditunggu & di-retry
+    RETRY_METHODS = ("getChatMember",)
+
+    def __init__(self, global_rate: float = API_GLOBAL_RATE, chat_rate: float = API_CHAT_RATE,
+                 group_rate: float = API_GROUP_RATE, max_chats: int = 10000):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_chats = max_chats
+        self.buckets = {}
+        self.chats = OrderedDict()
+
+    def bucket(self, bot_id: int):
+        if bot_id not in self.buckets: self.buckets[bot_id] = TokenBucket(self.global_rate)
+        return self.buckets[bot_id]
+
+    def chat_bucket(self, bot_id: int, chat_id):
+        key = (bot_id, chat_id)
+        bucket = self.chats.get(key)
+        if bucket is None:
+            # Chat private: ~1 pesan/detik; grup/channel (id negatif / @username): 20 pesan/menit
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = self.chats[key] = TokenBucket(self.chat_rate, 3) if private else TokenBucket(self.group_rate, 20)
+            while len(self.chats) > self.max_chats:
+                self.chats.popitem(last=False)
+        else:
+            self.chats.move_to_end(key)
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        if name in self.RETRY_METHODS:
+            for attempt in range(self.MAX_RETRIES):
+                try:
+                    return await make_request(bot, method)
+                except TelegramRetryAfter as e:
+                    log.warning("%s kena 429, retry %ds lagi", name, e.retry_after)
+                    await asyncio.sleep(e.retry_after)
+            return await make_request(bot, method)
+        if not self.global_rate or not name.startswith(self.SEND_PREFIXES):
+            return await make_request(bot, method)
+        start = time.perf_counter()
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None and self.chat_rate:
+            await self.chat_bucket(bot.id, chat_id).acquire()
+        bucket = self.bucket(bot.id)
+        await bucket.acquire()
+        metrics.observe("bot_api_wait_seconds", time.perf_counter() - start, method=name)
+        for attempt in range(self.MAX_RETRIES):
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                # Flood wait berlaku buat semua kiriman bot ini, jadi bucket global yang di-pause
+                bucket.pause(e.retry_after)
+                log.warning("%s kena 429, retry %ds lagi", name, e.retry_after)
+                await bucket.acquire()
+        return await make_request(bot, method)
+
+rate_limiter = RateLimitMiddleware()
+
+class ThrottleMiddleware(BaseMiddleware):
+    """Flood control per user: update kembar (callback/teks sama) dalam `window` detik digabung, sisanya dibatesin token bucket."""
+
+    def __init__(self, rate: float = THROTTLE_RATE, burst: int = THROTTLE_BURST, window: float = DUPLICATE_WINDOW,
+                 max_users: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.max_users = max_users
+        self.users = OrderedDict()
+        self.recent = OrderedDict()
+        self.inflight = set()
+
+    @staticmethod
+    def _key(update: Update):
+        if update.callback_query: return "cb:" + (update.callback_query.data or "")
+        if update.message and update.message.text: return "msg:" + update.message.text
+        return None
+
+    def _allow(self, user_key):
+        bucket = self.users.get(user_key)
+        if bucket is None:
+            bucket = self.users[user_key] = TokenBucket(self.rate, self.burst)
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(user_key)
+        return bucket.try_acquire()
+
+    async def _drop(self, event: Update, reason: str):
+        metrics.inc("bot_updates_dropped_total", reason=reason)
+        # Biar tombolnya ga muter terus
+        if event.callback_query:
+            try: await event.callback_query.answer()
+            except Exception: pass
+
+    async def __call__(self, handler, event: Update, data):
+        user = data.get("event_from_user")
+        if user is None or not self.rate: return await handler(event, data)
+        # Album & inline query (read-only, udah di-cache Telegram via cache_time) ga dihitung
+        if event.inline_query or (event.message and event.message.media_group_id): return await handler(event, data)
+        if await is_admin(user.id): return await handler(event, data)
+        now = time.monotonic()
+        # Window-nya sama semua, jadi urutan masuk = urutan kadaluarsa
+        while self.recent and next(iter(self.recent.values())) <= now:
+            self.recent.popitem(last=False)
+        key = self._key(event)
+        dup = key and (tenant().id, user.id, key)
+        if dup and (dup in self.inflight or dup in self.recent): return await self._drop(event, "duplicate")
+        if not self._allow((tenant().id, user.id)): return await self._drop(event, "throttle")
+        if not dup: return await handler(event, data)
+        self.inflight.add(dup)
+        try:
+            return await handler(event, data)
+        finally:
+            self.inflight.discard(dup)
+            self.recent[dup] = time.monotonic() + self.window
+
+throttle = ThrottleMiddleware()
+
+# ================= METRICS =================
+class Histogram:
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """Counter & histogram in-memory, diexport format Prometheus. Cuma operasi dict, murah."""
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        # Fungsi yang dipanggil pas scrape: yield (name, type, labels, value)
+        self.collectors = []
+
+    def inc(self, name: str, value: float = 1, **labels):
+        self.counters[(name, tuple(labels.items()))] += value
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.histograms[(name, tuple(labels.items()))].observe(seconds)
+
+    def counter(self, name: str, **labels):
+        return self.counters.get((name, tuple(labels.items())), 0)
+
+    def histogram_series(self, name: str):
+        """Histogram `name` per nilai label pertamanya."""
+        return {labels[0][1] if labels else "": h for (n, labels), h in self.histograms.items() if n == name}
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        items = list(labels) + list(extra)
+        if not items: return ""
+        body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+        return "{" + body + "}"
+
+    def render(self):
+        lines, typed = [], set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{self._labels(labels)} {value}")
+        for (name, labels), h in sorted(self.histograms.items(), key=lambda item: item[0]):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(Histogram.BUCKETS + ("+Inf",), h.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h.sum}")
+            lines.append(f"{name}_count{self._labels(labels)} {h.count}")
+        for collect in self.collectors:
+            for name, kind, labels, value in collect():
+                declare(name, kind)
+                lines.append(f"{name}{self._labels(labels.items())} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Catat durasi & error tiap handler (inner middleware, jadi nama handler udah ketahuan)."""
+
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        name = handler_obj.callback.__name__ if handler_obj else "unknown"
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            metrics.inc("bot_handler_errors_total", handler=name, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", time.perf_counter() - start, handler=name)
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Catat durasi tiap call Bot API keluar, plus error & RetryAfter (429)."""
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            metrics.inc("bot_api_retry_after_total", method=name)
+            raise
+        except Exception as e:
+            metrics.inc("bot_api_errors_total", method=name, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe("bot_api_seconds", time.perf_counter() - start, method=name)
+
+# Urutan penting: rate limiter paling luar, jadi tiap percobaan (termasuk retry 429) kecatat metrics
+bot.session.middleware(rate_limiter)
+bot.session.middleware(ApiMetricsMiddleware())
+
 # ================= DATABASE HELPER =================
-async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("CREATE TABLE IF NOT EXISTS media (code TEXT PRIMARY KEY, file_id TEXT, type TEXT, caption TEXT)")
-        await db.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY)")
-        await db.execute("CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT)")
-        await db.execute("CREATE TABLE IF NOT EXISTS admins (admin_id INTEGER PRIMARY KEY)")
-        await db.execute("CREATE TABLE IF NOT EXISTS titles (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT)")
-        await db.commit()
+class Database:
+    """Pool koneksi SQLite yang hidup selama proses: 1 writer + beberapa reader (WAL)."""
+
+    PRAGMAS = (
+        "PRAGMA busy_timeout=5000",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-8000",
+    )
+
+    def __init__(self, path: str, readers: int = 3):
+        self.path = path
+        self.reader_count = readers
+        self._writer = None
+        self._readers = asyncio.Queue()
+        self._reader_conns = []
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def started(self):
+        return self._writer is not None
+
+    async def _connect(self, readonly: bool):
+        # cached_statements = cache prepared statement per koneksi, kepake ulang selama proses hidup
+        conn = await aiosqlite.connect(self.path, cached_statements=256)
+        try:
+            for pragma in self.PRAGMAS + (("PRAGMA query_only=ON",) if readonly else ()):
+                async with conn.execute(pragma): pass
+        except BaseException:
+            await conn.close()
+            raise
+        return conn
+
+    async def _open(self):
+        self._writer = await self._connect(readonly=False)
+        async with self._writer.execute("PRAGMA journal_mode=WAL"): pass
+        for _ in range(self.reader_count):
+            self._reader_conns.append(await self._connect(readonly=True))
+        for conn in self._reader_conns:
+            self._readers.put_nowait(conn)
+
+    async def _close_conns(self):
+        """Tutup semua koneksi; dipanggil sambil megang write lock & semua reader."""
+        for conn in self._reader_conns:
+            await conn.close()
+        self._reader_conns = []
+        async with self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)"): pass
+        await self._writer.close()
+        self._writer = None
+
+    @asynccontextmanager
+    async def _paused(self):
+        """Stop semua query: pegang write lock & tunggu semua reader balik ke pool."""
+        async with self._write_lock:
+            for _ in self._reader_conns:
+                await self._readers.get()
+            yield
+
+    async def start(self):
+        if self.started: return
+        await self._open()
+
+    async def close(self):
+        if not self.started: return
+        async with self._paused():
+            await self._close_conns()
+
+    async def swap(self, path: str):
+        """Ganti file DB live dengan `path` (atomic rename). Query yang dateng selama swap nunggu."""
+        backup = self.path + ".bak"
+        async with self._paused():
+            await self._close_conns()
+            os.replace(self.path, backup)
+            os.replace(path, self.path)
+            # Sisa WAL/SHM punya file lama, jangan sampe kebaca file baru
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(self.path + suffix): os.remove(self.path + suffix)
+            try:
+                await self._open()
+            except BaseException:
+                os.replace(backup, self.path)
+                await self._open()
+                raise
+
+    async def snapshot(self, dest: str, pages: int = 256):
+        """Salinan konsisten DB live pakai online backup API SQLite, dicopy bertahap `pages` halaman per step."""
+        src = await aiosqlite.connect(self.path)
+        try:
+            dst = await aiosqlite.connect(dest)
+            try: await src.backup(dst, pages=pages, sleep=0.005)
+            finally: await dst.close()
+        finally:
+            await src.close()
+
+    @asynccontextmanager
+    async def read(self):
+        start = time.perf_counter()
+        conn = await self._readers.get()
+        metrics.observe("bot_db_wait_seconds", time.perf_counter() - start, op="read")
+        try:
+            yield conn
+        except Exception as e:
+            metrics.inc("bot_db_errors_total", op="read", error=type(e).__name__)
+            raise
+        finally:
+            self._readers.put_nowait(conn)
+            metrics.observe("bot_db_seconds", time.perf_counter() - start, op="read")
+
+    @asynccontextmanager
+    async def write(self):
+        """Satu transaksi di koneksi writer; commit kalau sukses, rollback kalau error."""
+        start = time.perf_counter()
+        async with self._write_lock:
+            metrics.observe("bot_db_wait_seconds", time.perf_counter() - start, op="write")
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException as e:
+                await self._writer.rollback()
+                if isinstance(e, Exception): metrics.inc("bot_db_errors_total", op="write", error=type(e).__name__)
+                raise
+            finally:
+                metrics.observe("bot_db_seconds", time.perf_counter() - start, op="write")
+
+    async def fetchone(self, sql, params=()):
+        async with self.read() as db:
+            async with db.execute(sql, params) as cur:
+                return await cur.fetchone()
+
+    async def fetchall(self, sql, params=()):
+        async with self.read() as db:
+            async with db.execute(sql, params) as cur:
+                return await cur.fetchall()
+
+    async def execute(self, sql, params=()):
+        async with self.write() as db:
+            await db.execute(sql, params)
+
+database = Database(DB_NAME)
+
+class Cache:
+    """Cache in-process buat tabel config, admins & media per bot (read-through, write-through)."""
+
+    def __init__(self, media_capacity: int = 4096):
+        self.media_capacity = media_capacity
+        self.config = {}
+        self.admins = {}
+        self.media = OrderedDict()
+        self.hits = Counter()
+        self.misses = Counter()
+        # Naik tiap ada write; load yang mulai sebelum write ga boleh nimpa data baru
+        self._generation = 0
+
+    def clear(self, bot_id: int = None):
+        self._generation += 1
+        if bot_id is None:
+            self.config.clear()
+            self.admins.clear()
+            self.media.clear()
+            return
+        self.config.pop(bot_id, None)
+        self.admins.pop(bot_id, None)
+        for key in [key for key in self.media if key[0] == bot_id]:
+            del self.media[key]
+
+    def stats(self):
+        return {name: (self.hits[name], self.misses[name]) for name in ("config", "admins", "media")}
+
+    async def get_config_map(self, bot_id: int):
+        config = self.config.get(bot_id)
+        if config is not None:
+            self.hits["config"] += 1
+            return config
+        self.misses["config"] += 1
+        gen = self._generation
+        config = dict(await database.fetchall("SELECT key, value FROM config WHERE bot_id=?", (bot_id,)))
+        if gen == self._generation: self.config[bot_id] = config
+        return config
+
+    def set_config(self, bot_id: int, key, value):
+        self._generation += 1
+        config = self.config.get(bot_id)
+        if config is None: return
+        if value is None: config.pop(key, None)
+        else: config[key] = value
+
+    async def get_admins(self, bot_id: int):
+        admins = self.admins.get(bot_id)
+        if admins is not None:
+            self.hits["admins"] += 1
+            return admins
+        self.misses["admins"] += 1
+        gen = self._generation
+        admins = {row[0] for row in await database.fetchall("SELECT admin_id FROM admins WHERE bot_id=?", (bot_id,))}
+        if gen == self._generation: self.admins[bot_id] = admins
+        return admins
+
+    async def get_media(self, bot_id: int, code):
+        key = (bot_id, code)
+        if key in self.media:
+            self.hits["media"] += 1
+            self.media.move_to_end(key)
+            return self.media[key]
+        self.misses["media"] += 1
+        gen = self._generation
+        # Kode yang ga ada juga dicache (None), biar link ngawur ga nembak disk terus
+        row = await database.fetchone("SELECT file_id, type, caption FROM media WHERE code=? AND bot_id=?", (code, bot_id))
+        if gen == self._generation: self.put_media(bot_id, code, row)
+        return row
+
+    def put_media(self, bot_id: int, code, row):
+        key = (bot_id, code)
+        self.media[key] = row
+        self.media.move_to_end(key)
+        while len(self.media) > self.media_capacity:
+            self.media.popitem(last=False)
+
+cache = Cache()
+
+async def init_db(db):
+    # bot_id = scope tenant (0 = bot utama), lihat TENANT
+    await db.execute("CREATE TABLE IF NOT EXISTS media (code TEXT PRIMARY KEY, file_id TEXT, type TEXT, caption TEXT, bot_id INTEGER NOT NULL DEFAULT 0)")
+    await db.execute("CREATE TABLE IF NOT EXISTS users (bot_id INTEGER NOT NULL DEFAULT 0, user_id INTEGER NOT NULL, PRIMARY KEY (bot_id, user_id))")
+    await db.execute("CREATE TABLE IF NOT EXISTS config (bot_id INTEGER NOT NULL DEFAULT 0, key TEXT NOT NULL, value TEXT, PRIMARY KEY (bot_id, key))")
+    await db.execute("CREATE TABLE IF NOT EXISTS admins (bot_id INTEGER NOT NULL DEFAULT 0, admin_id INTEGER NOT NULL, PRIMARY KEY (bot_id, admin_id))")
+    await db.execute("CREATE TABLE IF NOT EXISTS titles (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, bot_id INTEGER NOT NULL DEFAULT 0)")
+
+async def table_columns(db, table):
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        return [row[1] for row in await cur.fetchall()]
+
+async def init_tenant_db(db):
+    """DB lama (sebelum multi-bot) belum punya kolom bot_id: tambahin, data lama masuk bot utama."""
+    for table in ("media", "titles", "broadcasts"):
+        if "bot_id" not in await table_columns(db, table):
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN bot_id INTEGER NOT NULL DEFAULT 0")
+    # Tabel yang primary key-nya berubah harus dibikin ulang
+    rebuilds = {
+        "users": ("bot_id INTEGER NOT NULL DEFAULT 0, user_id INTEGER NOT NULL, PRIMARY KEY (bot_id, user_id)", "user_id"),
+        "config": ("bot_id INTEGER NOT NULL DEFAULT 0, key TEXT NOT NULL, value TEXT, PRIMARY KEY (bot_id, key)", "key, value"),
+        "admins": ("bot_id INTEGER NOT NULL DEFAULT 0, admin_id INTEGER NOT NULL, PRIMARY KEY (bot_id, admin_id)", "admin_id"),
+    }
+    for table, (columns, copy) in rebuilds.items():
+        if "bot_id" in await table_columns(db, table): continue
+        await db.execute(f"CREATE TABLE {table}_new ({columns})")
+        await db.execute(f"INSERT OR IGNORE INTO {table}_new ({copy}) SELECT {copy} FROM {table}")
+        await db.execute(f"DROP TABLE {table}")
+        await db.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
 
 async def get_config(key, default=None):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT value FROM config WHERE key=?", (key,)) as cursor:
-            row = await cursor.fetchone()
-            return row[0] if row else default
+    return (await cache.get_config_map(tenant().id)).get(key, default)
 
 async def set_config(key, value):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
-        await db.commit()
+    bot_id = tenant().id
+    await database.execute("INSERT OR REPLACE INTO config (bot_id, key, value) VALUES (?, ?, ?)", (bot_id, key, value))
+    cache.set_config(bot_id, key, value)
 
 async def is_admin(user_id: int):
-    if user_id == OWNER_ID: return True
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT admin_id FROM admins WHERE admin_id=?", (user_id,)) as cur:
-            return await cur.fetchone() is not None
+    if user_id == tenant().owner_id: return True
+    return user_id in await cache.get_admins(tenant().id)
+
+async def get_media(code):
+    return await cache.get_media(tenant().id, code)
+
+class MembershipCache:
+    """Cache TTL hasil cek join per (user_id, channel). Positif lama, negatif sebentar."""
+
+    def __init__(self, positive_ttl: float = 600, negative_ttl: float = 10, max_entries: int = 100_000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = {}
+
+    def get(self, user_id: int, channel: str):
+        entry = self._entries.get((user_id, channel.lower()))
+        if entry is None: return None
+        expires, joined = entry
+        if expires < time.monotonic():
+            del self._entries[(user_id, channel.lower())]
+            return None
+        return joined
+
+    def set(self, user_id: int, channel: str, joined: bool):
+        now = time.monotonic()
+        if len(self._entries) >= self.max_entries:
+            self._entries = {k: v for k, v in self._entries.items() if v[0] >= now}
+            if len(self._entries) >= self.max_entries: self._entries.clear()
+        ttl = self.positive_ttl if joined else self.negative_ttl
+        self._entries[(user_id, channel.lower())] = (now + ttl, joined)
+
+membership_cache = MembershipCache()
+
+JOINED_STATUSES = ("member", "administrator", "creator")
+
+async def is_joined(user_id: int, channel: str):
+    cached = membership_cache.get(user_id, channel)
+    if cached is not None: return cached
+    try:
+        m = await tenant().bot.get_chat_member(chat_id=f"@{channel}", user_id=user_id)
+        joined = m.status in JOINED_STATUSES
+    except (TelegramBadRequest, TelegramForbiddenError):
+        # Kalau channel ga ketemu/bot bukan admin, anggep wajib join
+        joined = False
+    except Exception:
+        # 429 yang abis retry, error jaringan/server: jawabannya belum pasti, jangan di-cache
+        log.warning("Gagal cek member @%s buat %s", channel, user_id, exc_info=True)
+        return False
+    membership_cache.set(user_id, channel, joined)
+    return joined
 
 async def check_membership(user_id: int):
     raw_targets = await get_config("fsub_channels")
     if not raw_targets or raw_targets.strip() == "": return []
     
     # Pecah berdasarkan spasi dan buang string kosong/sampah
-    targets = [t.strip() for t in raw_targets.split() if t.strip()]
-    unjoined = []
-    
-    for target in targets:
-        clean_target = target.replace("https://t.me/", "").replace("@", "")
-        if not clean_target: continue # Lewatin kalau kosong
-        
+    targets = [t.strip().replace("https://t.me/", "").replace("@", "") for t in raw_targets.split() if t.strip()]
+    targets = [t for t in targets if t] # Lewatin kalau kosong
+
+    # Semua channel dicek barengan, bukan satu-satu
+    results = await asyncio.gather(*(is_joined(user_id, t) for t in targets))
+    return [t for t, joined in zip(targets, results) if not joined]
+
+# ================= USER REGISTRY =================
+class UserRegistry:
+    """Registrasi user write-behind: (bot_id, user_id) dicek di set memory, INSERT dikumpulin lalu di-commit per batch."""
+
+    def __init__(self, flush_interval: float = 0.3, batch_size: int = 500):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.known = set()
+        self.pending = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def load(self):
+        self.known = set(await database.fetchall("SELECT bot_id, user_id FROM users")) | self.pending
+
+    def register(self, bot_id: int, user_id: int):
+        key = (bot_id, user_id)
+        if key in self.known: return
+        self.known.add(key)
+        self.pending.add(key)
+        if len(self.pending) >= self.batch_size: self._wakeup.set()
+
+    def forget(self, bot_id: int, user_ids):
+        """Dipanggil habis user dihapus dari DB, biar /start berikutnya didaftarin lagi."""
+        self.known.difference_update((bot_id, u) for u in user_ids)
+
+    async def flush(self):
+        if not self.pending: return
+        batch, self.pending = self.pending, set()
         try:
-            m = await bot.get_chat_member(chat_id=f"@{clean_target}", user_id=user_id)
-            if m.status not in ("member", "administrator", "creator"):
-                unjoined.append(clean_target)
-        except Exception:
-            # Kalau channel ga ketemu/bot bukan admin, anggep wajib join
-            unjoined.append(clean_target)
-    return unjoined
+            async with database.write() as db:
+                await db.executemany("INSERT OR IGNORE INTO users (bot_id, user_id) VALUES (?, ?)", batch)
+        except BaseException:
+            self.pending |= batch
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            try: await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError: pass
+            self._wakeup.clear()
+            try: await self.flush()
+            except Exception: log.exception("Gagal simpan user baru")
+
+    async def start(self):
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+user_registry = UserRegistry()
+
+# ================= FSM STORAGE =================
+async def init_fsm_db(db):
+    await db.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at REAL)")
+
+class SQLiteStorage(BaseStorage):
+    """Storage FSM di SQLite: data disimpen JSON ringkas, ada TTL + cache LRU kecil di depan."""
+
+    def __init__(self, ttl: float = 24 * 3600, cache_size: int = 1024, sweep_interval: float = 600):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.sweep_interval = sweep_interval
+        self._cache = OrderedDict()
+        self._sweeper = None
+
+    @staticmethod
+    def _key(key: StorageKey):
+        return ":".join(str(part) for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id,
+                                               key.business_connection_id, key.destiny))
+
+    def _remember(self, k, entry):
+        self._cache[k] = entry
+        self._cache.move_to_end(k)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, k):
+        """Balikin (state, data_json); session yang udah lewat TTL dianggep kosong."""
+        entry = self._cache.get(k)
+        if entry is None:
+            row = await database.fetchone("SELECT state, data, updated_at FROM fsm WHERE key=?", (k,))
+            entry = row or (None, None, 0.0)
+            self._remember(k, entry)
+        else:
+            self._cache.move_to_end(k)
+        state, data, updated_at = entry
+        if updated_at and updated_at < time.time() - self.ttl:
+            return None, None
+        return state, data
+
+    async def _save(self, k, state, data):
+        if state is None and not data:
+            await database.execute("DELETE FROM fsm WHERE key=?", (k,))
+            self._remember(k, (None, None, 0.0))
+            return
+        now = time.time()
+        await database.execute(
+            "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state=excluded.state, data=excluded.data, updated_at=excluded.updated_at",
+            (k, state, data, now))
+        self._remember(k, (state, data, now))
+
+    async def set_state(self, key: StorageKey, state=None):
+        k = self._key(key)
+        _, data = await self._load(k)
+        await self._save(k, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._load(self._key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data):
+        k = self._key(key)
+        state, _ = await self._load(k)
+        await self._save(k, state, json.dumps(data, separators=(",", ":")) if data else None)
+
+    async def get_data(self, key: StorageKey):
+        _, data = await self._load(self._key(key))
+        return json.loads(data) if data else {}
+
+    async def sweep(self):
+        cutoff = time.time() - self.ttl
+        await database.execute("DELETE FROM fsm WHERE updated_at < ?", (cutoff,))
+        for k in [k for k, entry in self._cache.items() if entry[2] < cutoff]:
+            del self._cache[k]
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try: await self.sweep()
+            except Exception: log.exception("Gagal sweep FSM")
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    async def close(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+fsm_storage = SQLiteStorage()
+dp = Dispatcher(storage=fsm_storage)
+dp.update.outer_middleware(TenantMiddleware())
+dp.update.outer_middleware(throttle)
+for event_name, observer in dp.observers.items():
+    if event_name not in ("update", "error"): observer.middleware(HandlerMetricsMiddleware())
 
 # ================= PAYMENT CORE DATABASE =================
-async def init_payment_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-
-        # tabel invoice pembayaran
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS invoices (
-            id TEXT PRIMARY KEY,
-            user_id INTEGER,
-            bot_id TEXT,
-            amount INTEGER,
-            status TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        # tabel bot clone
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS clone_bots (
-            id TEXT PRIMARY KEY,
-            owner_id INTEGER,
-            bot_token TEXT,
-            bot_username TEXT,
-            expire_date TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        # tabel payment log
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS payment_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            invoice_id TEXT,
-            raw_data TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-
-        await db.commit()
+async def init_payment_db(db):
+    # tabel invoice pembayaran
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS invoices (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER,
+        bot_id TEXT,
+        amount INTEGER,
+        status TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # tabel bot clone
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS clone_bots (
+        id TEXT PRIMARY KEY,
+        owner_id INTEGER,
+        bot_token TEXT,
+        bot_username TEXT,
+        expire_date TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    # tabel payment log
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS payment_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        invoice_id TEXT,
+        raw_data TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+# ================= BROADCAST ENGINE =================
+async def init_broadcast_db(db):
+    # tabel job broadcast; cursor = user_id terakhir yang udah diproses
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_chat_id INTEGER,
+        message_id INTEGER,
+        progress_chat_id INTEGER,
+        progress_message_id INTEGER,
+        status TEXT,
+        total INTEGER DEFAULT 0,
+        cursor INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        blocked INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,
+        bot_id INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+class Broadcaster:
+    """Job broadcast di background: rate-limited, bisa dicancel & lanjut lagi habis restart."""
+
+    BATCH_SIZE = 200
+    MAX_ATTEMPTS = 3
+    REPORT_INTERVAL = 5
+
+    def __init__(self, rate: float = 25, concurrency: int = 10):
+        # Limit global Telegram ~30 pesan/detik per bot, disisain dikit buat reply biasa
+        self.rate = rate
+        self.buckets = {}
+        self.concurrency = concurrency
+        self.tasks = {}
+
+    def bucket(self, bot_id: int):
+        if bot_id not in self.buckets: self.buckets[bot_id] = TokenBucket(self.rate)
+        return self.buckets[bot_id]
+
+    async def get_job(self, job_id: int):
+        row = await database.fetchone(
+            "SELECT id, bot_id, from_chat_id, message_id, progress_chat_id, progress_message_id, status, total, cursor, sent, failed, blocked "
+            "FROM broadcasts WHERE id=?", (job_id,))
+        if not row: return None
+        keys = ("id", "bot_id", "from_chat_id", "message_id", "progress_chat_id", "progress_message_id",
+                "status", "total", "cursor", "sent", "failed", "blocked")
+        return dict(zip(keys, row))
+
+    async def start_job(self, bot_id: int, from_chat_id: int, message_id: int, progress_chat_id: int, progress_message_id: int):
+        async with database.write() as db:
+            async with db.execute("SELECT COUNT(*) FROM users WHERE bot_id=?", (bot_id,)) as cur:
+                total = (await cur.fetchone())[0]
+            cur = await db.execute(
+                "INSERT INTO broadcasts (bot_id, from_chat_id, message_id, progress_chat_id, progress_message_id, status, total) "
+                "VALUES (?, ?, ?, ?, ?, 'running', ?)", (bot_id, from_chat_id, message_id, progress_chat_id, progress_message_id, total))
+            job_id = cur.lastrowid
+        self._spawn(job_id)
+        return job_id
+
+    async def resume(self):
+        """Lanjutin job yang masih 'running' pas proses mati (cuma buat bot yang lagi aktif)."""
+        for job_id, bot_id in await database.fetchall("SELECT id, bot_id FROM broadcasts WHERE status='running'"):
+            if bot_id in tenants: self._spawn(job_id)
+
+    async def cancel(self, job_id: int):
+        await database.execute(
+            "UPDATE broadcasts SET status='cancelled', finished_at=CURRENT_TIMESTAMP WHERE id=? AND status='running'", (job_id,))
+        task = self.tasks.get(job_id)
+        if task: task.cancel()
+
+    async def stop(self):
+        # Status di DB tetep 'running', jadi habis restart langsung dilanjut
+        tasks = list(self.tasks.values())
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, job_id: int):
+        if job_id not in self.tasks:
+            self.tasks[job_id] = asyncio.create_task(self._run(job_id))
+
+    async def _deliver(self, job, user_id: int):
+        bucket = self.bucket(job["bot_id"])
+        for _ in range(self.MAX_ATTEMPTS):
+            await bucket.acquire()
+            try:
+                await tenants[job["bot_id"]].bot.copy_message(user_id, job["from_chat_id"], job["message_id"])
+                return "sent"
+            except TelegramRetryAfter as e:
+                bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                # User blokir bot / akun dihapus
+                return "blocked"
+            except Exception:
+                return "failed"
+        return "failed"
+
+    async def _run(self, job_id: int):
+        job = await self.get_job(job_id)
+        sem = asyncio.Semaphore(self.concurrency)
+        last_report = 0.0
+
+        async def deliver(user_id):
+            async with sem:
+                return await self._deliver(job, user_id)
+
+        try:
+            while True:
+                # Bot clone dimatiin di tengah jalan: berhenti, lanjut lagi kalau aktif
+                if job["bot_id"] not in tenants: return
+                rows = await database.fetchall(
+                    "SELECT user_id FROM users WHERE bot_id=? AND user_id > ? ORDER BY user_id LIMIT ?",
+                    (job["bot_id"], job["cursor"], self.BATCH_SIZE))
+                if not rows: break
+                user_ids = [row[0] for row in rows]
+                results = await asyncio.gather(*(deliver(u) for u in user_ids))
+                blocked = [u for u, r in zip(user_ids, results) if r == "blocked"]
+                job["cursor"] = user_ids[-1]
+                job["sent"] += results.count("sent")
+                job["failed"] += results.count("failed")
+                job["blocked"] += len(blocked)
+                async with database.write() as db:
+                    # User yang blokir bot dibuang, broadcast berikutnya ga nyoba lagi
+                    if blocked: await db.executemany("DELETE FROM users WHERE bot_id=? AND user_id=?",
+                                                     [(job["bot_id"], u) for u in blocked])
+                    await db.execute("UPDATE broadcasts SET cursor=?, sent=?, failed=?, blocked=? WHERE id=?",
+                                     (job["cursor"], job["sent"], job["failed"], job["blocked"], job_id))
+                user_registry.forget(job["bot_id"], blocked)
+                if time.monotonic() - last_report > self.REPORT_INTERVAL:
+                    last_report = time.monotonic()
+                    await self.report(job)
+            await database.execute(
+                "UPDATE broadcasts SET status='done', finished_at=CURRENT_TIMESTAMP WHERE id=? AND status='running'", (job_id,))
+            job["status"] = "done"
+            await self.report(job)
+        finally:
+            self.tasks.pop(job_id, None)
+
+    @staticmethod
+    def progress_text(job):
+        done = job["sent"] + job["failed"] + job["blocked"]
+        return (f"📡 **BROADCAST #{job['id']}**\nStatus: `{job['status']}`\n"
+                f"Progres: {done}/{job['total']}\n"
+                f"✅ {job['sent']} | ❌ {job['failed']} | 🚫 {job['blocked']}")
+
+    @staticmethod
+    def progress_kb(job):
+        if job["status"] != "running": return None
+        return InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="🔄 REFRESH", callback_data=f"bc_status:{job['id']}"),
+            InlineKeyboardButton(text="⛔ CANCEL", callback_data=f"bc_cancel:{job['id']}")
+        ]])
+
+    async def report(self, job):
+        if job["bot_id"] not in tenants: return
+        try:
+            await tenants[job["bot_id"]].bot.edit_message_text(self.progress_text(job), chat_id=job["progress_chat_id"],
+                                        message_id=job["progress_message_id"], reply_markup=self.progress_kb(job))
+        except Exception:
+            pass
+
+broadcaster = Broadcaster()
+
+# ================= SEARCH =================
+SEARCH_PAGE = 20
+
+def fts_query(text: str):
+    """Input user -> query FTS5 yang aman: tiap kata jadi prefix match, semua kata harus ada."""
+    return " ".join(f'"{w}"*' for w in re.findall(r"\w+", text.lower())[:8])
+
+async def search_catalog(bot_id: int, text: str, cursor: str = "", limit: int = SEARCH_PAGE):
+    """Cari judul lalu caption, terbaru duluan. Balikin (rows (result_id, label, caption, code), cursor halaman berikutnya).
+
+    result_id = 't<id judul>' / 'm<id media>': unik per hasil, beda sama code (judul & caption part-nya bisa link ke code yang sama).
+    """
+    query = fts_query(text)
+    kind, _, last = cursor.partition(":")
+    last = int(last) if last.isdigit() else 1 << 62
+    # Keyset per rowid (bukan bm25/OFFSET): FTS5 bisa langsung jalan mundur dari rowid, tetep cepet walau match puluhan ribu.
+    # CROSS JOIN = paksa index FTS jalan duluan; kalau ga, planner bisa scan semua judul terus MATCH satu-satu.
+    # Judul yang udah pernah dipost: link ke seri terbarunya (semua part sekaligus), kalau belum ke part pertama
+    first_code = ("coalesce((SELECT 's_' || code FROM posts WHERE title_id = t.id ORDER BY id DESC LIMIT 1), "
+                  "(SELECT code FROM media WHERE title_id = t.id ORDER BY id LIMIT 1))")
+    rows = []
+    if kind in ("", "t"):
+        if query:
+            rows = await database.fetchall(
+                f"SELECT 't' || t.id, t.title, NULL, {first_code} AS code FROM titles_fts f CROSS JOIN titles t ON t.id = f.rowid "
+                "WHERE titles_fts MATCH ? AND f.rowid < ? AND t.bot_id = ? AND code IS NOT NULL ORDER BY f.rowid DESC LIMIT ?",
+                (query, last, bot_id, limit))
+        else:
+            rows = await database.fetchall(
+                f"SELECT 't' || t.id, t.title, NULL, {first_code} AS code FROM titles t "
+                "WHERE t.bot_id = ? AND t.id < ? AND code IS NOT NULL ORDER BY t.id DESC LIMIT ?", (bot_id, last, limit))
+        if len(rows) == limit: return rows, f"t:{rows[-1][0][1:]}"
+        last = 1 << 62
+    if not query: return rows, ""
+    more = await database.fetchall(
+        "SELECT 'm' || m.id, coalesce(t.title, m.caption), m.caption, m.code FROM media_fts f CROSS JOIN media m ON m.id = f.rowid "
+        "LEFT JOIN titles t ON t.id = m.title_id WHERE media_fts MATCH ? AND f.rowid < ? AND m.bot_id = ? "
+        "ORDER BY f.rowid DESC LIMIT ?", (query, last, bot_id, limit - len(rows)))
+    rows += more
+    return rows, (f"m:{rows[-1][0][1:]}" if more and len(rows) == limit else "")
+
+def inline_results(rows, username: str):
+    # Judul/caption mentah (banyak `_` & `[`): bold pake entity, jangan lewat parse mode Markdown
+    return [InlineQueryResultArticle(
+        id=result_id, title=label[:100], description=(caption or "")[:100] or None,
+        input_message_content=InputTextMessageContent(**Text("🎬 ", Bold(label)).as_kwargs(text_key="message_text")),
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🎬 TONTON", url=f"https://t.me/{username}?start={code}")]]))
+        for result_id, label, caption, code in rows]
+
+@dp.inline_query()
+async def inline_search(q: InlineQuery):
+    rows, next_offset = await search_catalog(tenant().id, q.query, q.offset)
+    results = inline_results(rows, (await q.bot.me()).username)
+    await q.answer(results, cache_time=30, is_personal=False, next_offset=next_offset)
 
 # ================= KEYBOARDS =================
-async def get_titles_kb():
-    kb = []
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT title FROM titles ORDER BY id DESC LIMIT 10") as cur:
-            async for row in cur:
-                kb.append([InlineKeyboardButton(text=row[0], callback_data=f"t_sel:{row[0][:20]}")])
+TITLES_PAGE = 10
+
+async def get_titles_kb(before: int = 0, query: str = None):
+    """Pilih judul: `query` = cari via FTS, kalau ga halaman keyset (judul dengan id < `before`)."""
+    bot_id = tenant().id
+    if query and fts_query(query):
+        rows = await database.fetchall(
+            "SELECT t.id, t.title FROM titles_fts f CROSS JOIN titles t ON t.id = f.rowid "
+            "WHERE titles_fts MATCH ? AND t.bot_id = ? ORDER BY f.rowid DESC LIMIT ?", (fts_query(query), bot_id, TITLES_PAGE))
+        more = False
+    else:
+        # Keyset: lanjut dari id terakhir halaman sebelumnya, ga pake OFFSET biar tetep cepet di katalog gede
+        rows = await database.fetchall("SELECT id, title FROM titles WHERE bot_id=? AND id < ? ORDER BY id DESC LIMIT ?",
+                                       (bot_id, before or 1 << 62, TITLES_PAGE + 1))
+        more, rows = len(rows) > TITLES_PAGE, rows[:TITLES_PAGE]
+    kb = [[InlineKeyboardButton(text=title, callback_data=f"t_sel:{title_id}")] for title_id, title in rows]
+    nav = []
+    if before or query: nav.append(InlineKeyboardButton(text="⏮ AWAL", callback_data="t_page:0"))
+    if more: nav.append(InlineKeyboardButton(text="LANJUT ▶️", callback_data=f"t_page:{rows[-1][0]}"))
+    if nav: kb.append(nav)
     kb.append([InlineKeyboardButton(text="➕ TAMBAH JUDUL", callback_data="add_title_btn")])
     return InlineKeyboardMarkup(inline_keyboard=kb)
 
@@ -154,9 +1192,7 @@ def member_main_kb():
 # ================= MEMBER & FSUB =================
 @dp.message(CommandStart())
 async def start_handler(m: Message):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (m.from_user.id,))
-        await db.commit()
+    user_registry.register(tenant().id, m.from_user.id)
 
     args = m.text.split()
     target_code = args[1] if len(args) > 1 else "none"
@@ -171,17 +1207,48 @@ async def start_handler(m: Message):
         kb_list.append([InlineKeyboardButton(text="🔄 COBA LAGI", callback_data=f"check_sub:{target_code}")])
         return await m.answer("⚠️ **AKSES DIKUNCI**\nSilahkan join channel yang muncul di bawah ini untuk lanjut.", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_list))
 
-    if target_code != "none":
-        async with aiosqlite.connect(DB_NAME) as db:
-            async with db.execute("SELECT file_id, type, caption FROM media WHERE code=?", (target_code,)) as cur:
-                row = await cur.fetchone()
-                if row:
-                    if row[1] == "photo": await bot.send_photo(m.chat.id, row[0], caption=row[2], protect_content=True)
-                    else: await bot.send_video(m.chat.id, row[0], caption=row[2], protect_content=True)
-                    return
+    if target_code.startswith("s_"):
+        if await send_series(m, target_code[2:]): return
+    elif target_code != "none":
+        row = await get_media(target_code)
+        if row:
+            if row[1] == "photo": await m.bot.send_photo(m.chat.id, row[0], caption=row[2], protect_content=True)
+            else: await m.bot.send_video(m.chat.id, row[0], caption=row[2], protect_content=True)
+            return
 
     await m.answer(f"👋 Halo {m.from_user.first_name}!", reply_markup=member_main_kb())
 
+# Maks item per sendMediaGroup (limit Telegram)
+SERIES_BATCH = 10
+
+async def send_series(m: Message, param: str):
+    """Deep link `s_<kode post>` (semua part) / `s_<kode post>_<halaman>`: dikirim per album isi 10."""
+    code, _, page = param.partition("_")
+    bot_id = tenant().id
+    rows = await database.fetchall(
+        "SELECT m.file_id, m.type, m.caption FROM posts p JOIN post_parts pp ON pp.post_id = p.id "
+        "JOIN media m ON m.code = pp.media_code WHERE p.code = ? AND p.bot_id = ? ORDER BY pp.position", (code, bot_id))
+    batches = [rows[i:i + SERIES_BATCH] for i in range(0, len(rows), SERIES_BATCH)]
+    if page.isdigit(): batches = batches[int(page) - 1:int(page)] if int(page) > 0 else []
+    if not batches: return False
+    # Caption = teks mentah dari m.caption (banyak `_` & `[`), jadi kirim tanpa parse mode
+    for batch in batches:
+        try:
+            if len(batch) == 1:
+                file_id, mtype, caption = batch[0]
+                if mtype == "photo": await m.bot.send_photo(m.chat.id, file_id, caption=caption, parse_mode=None, protect_content=True)
+                else: await m.bot.send_video(m.chat.id, file_id, caption=caption, parse_mode=None, protect_content=True)
+                continue
+            media = [(InputMediaPhoto if mtype == "photo" else InputMediaVideo)(media=file_id, caption=caption, parse_mode=None)
+                     for file_id, mtype, caption in batch]
+            await m.bot.send_media_group(m.chat.id, media, protect_content=True)
+        except (TelegramForbiddenError, TelegramRetryAfter):
+            raise
+        except Exception:
+            # Satu album gagal (file_id basi dll) jangan sampe album sisanya ga kekirim
+            log.exception("Gagal kirim album series %s ke %s", code, m.chat.id)
+    return True
+
 @dp.callback_query(F.data.startswith("check_sub:"))
 async def check_sub_cb(c: CallbackQuery):
     unjoined = await check_membership(c.from_user.id)
@@ -194,23 +1261,66 @@ async def check_sub_cb(c: CallbackQuery):
     new_m = Message(
         message_id=c.message.message_id, date=c.message.date, chat=c.message.chat,
         from_user=c.from_user, text=f"/start {code}"
-    )
+    ).as_(c.bot)
     await start_handler(new_m)
 
 # ================= LOGIKA AUTO POST (MULTI-PART) =================
+class AlbumCollector:
+    """Kumpulin pesan satu album (media_group_id) sampai ga ada part baru selama `window` detik."""
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self._groups = {}
+
+    async def collect(self, m: Message):
+        """Handler pesan pertama nunggu & dapet semua part (urut message_id); sisanya dapet None."""
+        key = (m.chat.id, m.media_group_id)
+        group = self._groups.get(key)
+        if group is not None:
+            group.append(m)
+            return None
+        group = self._groups[key] = [m]
+        size = 0
+        while size != len(group):
+            size = len(group)
+            await asyncio.sleep(self.window)
+        del self._groups[key]
+        return sorted(group, key=lambda x: x.message_id)
+
+albums = AlbumCollector()
+
+def media_entry(m: Message):
+    fid = m.photo[-1].file_id if m.photo else (m.video.file_id if m.video else m.document.file_id)
+    mtype = "photo" if m.photo else "video"
+    return [fid, mtype, m.caption or ""]
+
+async def collect_parts(m: Message):
+    if not m.media_group_id: return [m]
+    return await albums.collect(m)
+
 @dp.message(F.chat.type == "private", (F.photo | F.video | F.document), StateFilter(None))
 async def admin_upload(m: Message, state: FSMContext):
     if not await is_admin(m.from_user.id): return
-    fid = m.photo[-1].file_id if m.photo else (m.video.file_id if m.video else m.document.file_id)
-    mtype = "photo" if m.photo else "video"
-    await state.update_data(temp_fid=fid, temp_type=mtype, temp_caption=(m.caption or ""), parts=[])
+    album = await collect_parts(m)
+    if not album: return
+    await state.update_data(temp_parts=[media_entry(x) for x in album], parts=[])
     await state.set_state(PostMedia.waiting_for_post_title)
-    await m.reply("📝 **PILIH JUDUL:**", reply_markup=await get_titles_kb())
+    await m.reply("📝 **PILIH JUDUL:**\n_Ketik buat cari judul lama._", reply_markup=await get_titles_kb())
+
+@dp.callback_query(PostMedia.waiting_for_post_title, F.data.startswith("t_page:"))
+async def titles_page_cb(c: CallbackQuery):
+    await c.message.edit_reply_markup(reply_markup=await get_titles_kb(int(c.data.split(":")[1])))
+    await c.answer()
+
+@dp.message(PostMedia.waiting_for_post_title, F.text)
+async def search_title_handler(m: Message):
+    await m.reply(**Text("🔎 ", Bold(m.text)).as_kwargs(), reply_markup=await get_titles_kb(query=m.text))
 
 @dp.callback_query(PostMedia.waiting_for_post_title, F.data.startswith("t_sel:"))
 async def select_title_handler(c: CallbackQuery, state: FSMContext):
-    title = c.data.split(":")[1]
-    await add_part_to_list(c.message, state, title)
+    row = await database.fetchone("SELECT id, title FROM titles WHERE id=? AND bot_id=?", (int(c.data.split(":")[1]), tenant().id))
+    if not row: return await c.answer("Judul ga ketemu.")
+    await add_part_to_list(c.message, state, row[1], row[0])
 
 @dp.callback_query(PostMedia.waiting_for_post_title, F.data == "add_title_btn")
 async def add_new_title_btn(c: CallbackQuery, state: FSMContext):
@@ -219,28 +1329,31 @@ async def add_new_title_btn(c: CallbackQuery, state: FSMContext):
 
 @dp.message(AdminStates.waiting_for_add_title)
 async def process_save_title(m: Message, state: FSMContext):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT INTO titles (title) VALUES (?)", (m.text,))
-        await db.commit()
-    await add_part_to_list(m, state, m.text)
+    async with database.write() as db:
+        async with db.execute("INSERT INTO titles (title, bot_id) VALUES (?, ?)", (m.text, tenant().id)) as cur:
+            title_id = cur.lastrowid
+    await add_part_to_list(m, state, m.text, title_id)
 
-async def add_part_to_list(msg, state, p_title):
+async def add_part_to_list(msg, state, p_title, title_id=None):
     data = await state.get_data()
-    code = uuid.uuid4().hex[:15]
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT OR IGNORE INTO media (code, file_id, type, caption) VALUES (?, ?, ?, ?)", 
-                         (code, data['temp_fid'], data['temp_type'], data['temp_caption']))
-        await db.commit()
+    bot_id = tenant().id
+    rows = [(uuid.uuid4().hex[:15], *entry) for entry in data['temp_parts']]
+    # Satu album = satu transaksi
+    async with database.write() as db:
+        await db.executemany("INSERT OR IGNORE INTO media (code, file_id, type, caption, bot_id, title_id) VALUES (?, ?, ?, ?, ?, ?)",
+                             [(*row, bot_id, title_id) for row in rows])
+    for code, *media in rows: cache.put_media(bot_id, code, tuple(media))
     
-    parts = data.get('parts', [])
-    parts.append(code)
-    await state.update_data(parts=parts, current_title=p_title)
+    parts = data.get('parts', []) + [row[0] for row in rows]
+    await state.update_data(parts=parts, current_title=p_title, current_title_id=title_id, temp_parts=[])
     
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="➕ TAMBAH PART LAIN", callback_data="add_more_part")],
         [InlineKeyboardButton(text="🚀 POST SEKARANG", callback_data="final_post")]
     ])
-    await msg.answer(f"✅ Part {len(parts)} siap.\nJudul: **{p_title}**", reply_markup=kb)
+    first = len(parts) - len(rows) + 1
+    label = f"Part {len(parts)}" if len(rows) == 1 else f"Part {first}-{len(parts)}"
+    await msg.answer(f"✅ {label} siap.\nJudul: **{p_title}**", reply_markup=kb)
     await state.set_state(PostMedia.waiting_for_final_confirm)
 
 @dp.callback_query(PostMedia.waiting_for_final_confirm, F.data == "add_more_part")
@@ -251,35 +1364,51 @@ async def add_more_part_cb(c: CallbackQuery, state: FSMContext):
 
 @dp.message(F.chat.type == "private", (F.photo | F.video | F.document), StateFilter(PostMedia.waiting_for_final_confirm))
 async def handle_next_part(m: Message, state: FSMContext):
+    album = await collect_parts(m)
+    if not album: return
     data = await state.get_data()
-    fid = m.photo[-1].file_id if m.photo else (m.video.file_id if m.video else m.document.file_id)
-    mtype = "photo" if m.photo else "video"
-    await state.update_data(temp_fid=fid, temp_type=mtype, temp_caption=(m.caption or ""))
-    await add_part_to_list(m, state, data['current_title'])
+    await state.update_data(temp_parts=[media_entry(x) for x in album])
+    await add_part_to_list(m, state, data['current_title'], data.get('current_title_id'))
+
+async def save_post(parts, title, title_id=None):
+    """Simpen satu seri (judul + urutan part) buat deep link `s_<kode>`."""
+    code = uuid.uuid4().hex[:12]
+    async with database.write() as db:
+        async with db.execute("INSERT INTO posts (code, bot_id, title_id, title) VALUES (?, ?, ?, ?)",
+                              (code, tenant().id, title_id, title)) as cur:
+            post_id = cur.lastrowid
+        await db.executemany("INSERT INTO post_parts (post_id, position, media_code) VALUES (?, ?, ?)",
+                             [(post_id, i, part) for i, part in enumerate(parts, 1)])
+    return code
 
 @dp.callback_query(PostMedia.waiting_for_final_confirm, F.data == "final_post")
 async def final_post_handler(c: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     parts, p_title = data['parts'], data['current_title']
-    bot_user = (await bot.get_me()).username
+    # Bot.me() di-cache aiogram, ga get_me tiap post
+    bot_user = (await c.bot.me()).username
     
     kb_rows = []
     if len(parts) == 1:
         kb_rows.append([InlineKeyboardButton(text="🎬 TONTON", url=f"https://t.me/{bot_user}?start={parts[0]}")])
     else:
-        row = []
-        for i, code in enumerate(parts, 1):
-            row.append(InlineKeyboardButton(text=f"Part {i}", url=f"https://t.me/{bot_user}?start={code}"))
-            if len(row) == 2:
-                kb_rows.append(row); row = []
-        if row: kb_rows.append(row)
+        code = await save_post(parts, p_title, data.get('current_title_id'))
+        kb_rows.append([InlineKeyboardButton(text=f"🎬 TONTON SEMUA ({len(parts)} PART)", url=f"https://t.me/{bot_user}?start=s_{code}")])
+        if len(parts) > SERIES_BATCH:
+            row = []
+            for page, first in enumerate(range(1, len(parts) + 1, SERIES_BATCH), 1):
+                last = min(first + SERIES_BATCH - 1, len(parts))
+                row.append(InlineKeyboardButton(text=f"Part {first}-{last}", url=f"https://t.me/{bot_user}?start=s_{code}_{page}"))
+                if len(row) == 2:
+                    kb_rows.append(row); row = []
+            if row: kb_rows.append(row)
 
     ch = await get_config("channel_post")
     cover = await get_config("cover_file_id")
     if ch:
         try:
-            if cover: await bot.send_photo(ch, cover, caption=f" **{p_title}**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_rows))
-            else: await bot.send_message(ch, f" **{p_title}**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_rows))
+            if cover: await c.bot.send_photo(ch, cover, caption=f" **{p_title}**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_rows))
+            else: await c.bot.send_message(ch, f" **{p_title}**", reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_rows))
             await c.message.answer("✅ Posted!")
         except Exception as e: await c.message.answer(f"❌ Error: {e}")
     await state.clear()
@@ -291,8 +1420,9 @@ async def ask_btn(c: CallbackQuery, state: FSMContext):
 
 @dp.message(MemberStates.waiting_for_ask)
 async def process_ask(m: Message, state: FSMContext):
-    await m.forward(OWNER_ID)
-    await bot.send_message(OWNER_ID, f"📩 **ASK DARI: {m.from_user.id}**", 
+    owner_id = tenant().owner_id
+    await m.forward(owner_id)
+    await m.bot.send_message(owner_id, f"📩 **ASK DARI: {m.from_user.id}**", 
                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="↩️ REPLY", callback_data=f"reply:{m.from_user.id}")]]))
     await m.reply("✅ Terkirim."); await state.clear()
 
@@ -303,27 +1433,33 @@ async def donasi_btn(c: CallbackQuery, state: FSMContext):
 @dp.message(MemberStates.waiting_for_donation)
 async def process_donation(m: Message, state: FSMContext):
     cap = m.caption or m.text or "Tanpa pesan"
-    await m.forward(OWNER_ID)
-    await bot.send_message(OWNER_ID, f"🎁 **DONASI BARU**\nUser: `{m.from_user.id}`\nCaption: {cap}")
+    owner_id = tenant().owner_id
+    await m.forward(owner_id)
+    await m.bot.send_message(owner_id, f"🎁 **DONASI BARU**\nUser: `{m.from_user.id}`\nCaption: {cap}")
     await m.reply("✅ Terkirim."); await state.clear()
 
 @dp.callback_query(F.data == "menu_vip")
 async def order_vip(c: CallbackQuery, state: FSMContext):
     qris = await get_config("qris_file_id")
     if not qris: return await c.answer("QRIS kosong.", show_alert=True)
-    await bot.send_photo(c.message.chat.id, qris, caption="Kirim SS Bukti Bayar:")
+    price = await get_config("vip_price")
+    invoice_id = await create_invoice(c.from_user.id, int(price) if price else None)
+    total = f"Total: Rp{int(price):,}\n".replace(",", ".") if price else ""
+    await c.bot.send_photo(c.message.chat.id, qris, caption=(
+        f"Kode bayar: `{invoice_id}`\n{total}\nPembayaran dicek otomatis. Kalau belum masuk, kirim SS Bukti Bayar:"))
     await state.set_state(MemberStates.waiting_for_vip_ss)
 
 @dp.callback_query(F.data == "vip_preview")
 async def preview_vip(c: CallbackQuery):
     prev = await get_config("preview_msg_id")
-    if prev: await bot.copy_message(c.message.chat.id, OWNER_ID, int(prev))
+    if prev: await c.bot.copy_message(c.message.chat.id, tenant().owner_id, int(prev))
     else: await c.answer("Preview kosong.")
 
 @dp.message(MemberStates.waiting_for_vip_ss, F.photo)
 async def process_vip_ss(m: Message, state: FSMContext):
-    await m.forward(OWNER_ID)
-    await bot.send_message(OWNER_ID, f"💎 **VIP SS: {m.from_user.id}**", 
+    owner_id = tenant().owner_id
+    await m.forward(owner_id)
+    await m.bot.send_message(owner_id, f"💎 **VIP SS: {m.from_user.id}**", 
                            reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔑 REPLY", callback_data=f"reply:{m.from_user.id}")]]))
     await m.reply("✅ SS Terkirim."); await state.clear()
 
@@ -336,16 +1472,47 @@ async def admin_panel(message: Message):
         [InlineKeyboardButton(text="🖼 COVER", callback_data="set_cover"), InlineKeyboardButton(text="🖼 QRIS", callback_data="set_qris")],
         [InlineKeyboardButton(text="📺 PREVIEW", callback_data="set_preview")],
         [InlineKeyboardButton(text="📡 BC", callback_data="menu_broadcast"), InlineKeyboardButton(text="📦 DB", callback_data="menu_db")],
+        [InlineKeyboardButton(text="📊 STATS", callback_data="panel_stats")],
         [InlineKeyboardButton(text="❌ TUTUP", callback_data="close_panel")]
     ]
     await message.reply("🛠 **PANEL**", reply_markup=InlineKeyboardMarkup(inline_keyboard=btns))
 
+def stats_text():
+    def avg_ms(h): return h.sum / h.count * 1000 if h.count else 0.0
+    handlers = metrics.histogram_series("bot_handler_seconds")
+    api = metrics.histogram_series("bot_api_seconds")
+    db = metrics.histogram_series("bot_db_seconds")
+    wait = metrics.histogram_series("bot_db_wait_seconds")
+    errors = sum(v for (name, _), v in metrics.counters.items() if name == "bot_handler_errors_total")
+    retry_after = sum(v for (name, _), v in metrics.counters.items() if name == "bot_api_retry_after_total")
+    lines = [f"⚡ Update: {sum(h.count for h in handlers.values())} | ❌ Error: {errors} | ⏳ 429: {retry_after}"]
+    lines.append("\n**Handler terlambat (avg ms):**")
+    for name, h in sorted(handlers.items(), key=lambda item: -avg_ms(item[1]))[:5]:
+        lines.append(f"`{name}` {avg_ms(h):.1f} ({h.count}x)")
+    lines.append("\n**Bot API (avg ms):**")
+    for name, h in sorted(api.items(), key=lambda item: -item[1].count)[:5]:
+        lines.append(f"`{name}` {avg_ms(h):.1f} ({h.count}x)")
+    lines.append("\n**DB (avg ms, tunggu):**")
+    for op, h in sorted(db.items()):
+        lines.append(f"`{op}` {avg_ms(h):.1f} ({h.count}x), tunggu {avg_ms(wait[op]) if op in wait else 0:.1f}")
+    return "📊 **STATS**\n" + "\n".join(lines)
+
+@dp.callback_query(F.data == "panel_stats")
+async def panel_stats_cb(c: CallbackQuery):
+    if not await is_admin(c.from_user.id): return
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔄 REFRESH", callback_data="panel_stats"),
+                                                InlineKeyboardButton(text="🔙 KEMBALI", callback_data="close_panel")]])
+    try: await c.message.edit_text(stats_text(), reply_markup=kb)
+    except Exception: pass
+    await c.answer()
+
 @dp.callback_query(F.data == "open_settings")
 async def settings_cb(c: CallbackQuery):
     if not await is_admin(c.from_user.id): return
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="📢 POST CH", callback_data="set_post")],
         [InlineKeyboardButton(text="👥 FSUB", callback_data="set_fsub_list")],
+        [InlineKeyboardButton(text="💰 HARGA VIP", callback_data="set_vip_price")],
         [InlineKeyboardButton(text="🔙 KEMBALI", callback_data="close_panel")]
     ])
     await c.message.edit_text("⚙️ **CONFIG**", reply_markup=kb)
@@ -358,18 +1525,81 @@ async def set_fsub_cb(c: CallbackQuery, state: FSMContext):
 async def process_fsub(m: Message, state: FSMContext):
     await set_config("fsub_channels", m.text.strip()); await m.reply("✅ Set."); await state.clear()
 
-@dp.callback_query(F.data == "menu_db", F.from_user.id == OWNER_ID)
+@dp.callback_query(F.data == "set_vip_price")
+async def set_vip_price_cb(c: CallbackQuery, state: FSMContext):
+    await c.message.answer("Kirim harga VIP (angka, 0 = bebas):"); await state.set_state(AdminStates.waiting_for_vip_price)
+
+@dp.message(AdminStates.waiting_for_vip_price)
+async def process_vip_price(m: Message, state: FSMContext):
+    price = (m.text or "").strip().replace(".", "")
+    if not price.isdigit(): return await m.reply("❌ Angka aja.")
+    await set_config("vip_price", str(int(price)) if int(price) else None); await m.reply("✅ Set."); await state.clear()
+
+def gzip_file(src: str, dest: str):
+    with open(src, "rb") as fin, gzip.open(dest, "wb", compresslevel=6) as fout:
+        shutil.copyfileobj(fin, fout, 1 << 20)
+
+def prepare_restore(path: str) -> str | None:
+    """Unzip kalau .gz lalu cek file DB-nya. Balikin pesan error, None kalau aman."""
+    with open(path, "rb") as f: gz = f.read(2) == b"\x1f\x8b"
+    if gz:
+        with gzip.open(path, "rb") as fin, open(path + ".tmp", "wb") as fout:
+            shutil.copyfileobj(fin, fout, 1 << 20)
+        os.replace(path + ".tmp", path)
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            if conn.execute("PRAGMA integrity_check").fetchone()[0] != "ok": return "DB rusak (integrity_check gagal)"
+            tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        finally: conn.close()
+    except sqlite3.DatabaseError as e:
+        return f"Bukan file DB: {e}"
+    missing = {"media", "users", "config"} - tables
+    return f"Tabel ga ada: {', '.join(sorted(missing))}" if missing else None
+
+@dp.callback_query(F.data == "menu_db", is_main_owner)
 async def send_db_cb(c: CallbackQuery):
-    if os.path.exists(DB_NAME): await c.message.reply_document(FSInputFile(DB_NAME))
-    await c.answer()
+    await c.answer("⏳ Bikin backup...")
+    # Snapshot online: bot tetep jalan, file yang dikirim konsisten walau lagi ada write
+    with tempfile.TemporaryDirectory(dir=BASE_DIR) as tmp:
+        raw, gz = os.path.join(tmp, "media.db"), os.path.join(tmp, "media.db.gz")
+        await database.snapshot(raw)
+        await asyncio.to_thread(gzip_file, raw, gz)
+        name = time.strftime("media-%Y%m%d-%H%M%S.db.gz")
+        await c.message.reply_document(FSInputFile(gz, filename=name))
 
 @dp.message(Command("update"))
 async def update_database(m: Message):
-    if not await is_admin(m.from_user.id): return
-    if not m.reply_to_message or not m.reply_to_message.document: return await m.reply("❌ Reply .db")
-    file = await bot.get_file(m.reply_to_message.document.file_id)
-    await bot.download_file(file.file_path, DB_NAME)
-    await init_db(); await m.reply("✅ UPDATED")
+    # File DB isinya data semua bot clone juga, jadi cuma buat bot utama
+    if tenant() is not main_tenant or not await is_admin(m.from_user.id): return
+    if not m.reply_to_message or not m.reply_to_message.document: return await m.reply("❌ Reply .db / .db.gz")
+    file = await m.bot.get_file(m.reply_to_message.document.file_id)
+    incoming = DB_NAME + ".incoming"
+    try:
+        # Download & cek di file terpisah, DB live ga disentuh sampe file baru lolos semua
+        await m.bot.download_file(file.file_path, incoming)
+        if err := await asyncio.to_thread(prepare_restore, incoming): return await m.reply(f"❌ {err}")
+        staging = Database(incoming, readers=0)
+        await staging.start()
+        try: await migrate_db(staging)
+        finally: await staging.close()
+        await broadcaster.stop()
+        await user_registry.flush()
+        try: await database.swap(incoming)
+        except Exception:
+            await broadcaster.resume()
+            raise
+    except Exception as e:
+        log.exception("Restore DB gagal")
+        return await m.reply(f"❌ Restore gagal: {e}")
+    finally:
+        if os.path.exists(incoming): os.remove(incoming)
+    cache.clear()
+    fsm_storage.clear_cache()
+    await user_registry.load()
+    await clones.sync()
+    await broadcaster.resume()
+    await m.reply("✅ UPDATED")
 
 @dp.callback_query(F.data.startswith("reply:"))
 async def reply_cb(c: CallbackQuery, state: FSMContext):
@@ -380,7 +1610,9 @@ async def reply_cb(c: CallbackQuery, state: FSMContext):
 async def process_reply_send(m: Message, state: FSMContext):
     d = await state.get_data()
     try: await m.copy_to(d['target']); await m.reply("✅ OK")
-    except: await m.reply("❌ Gagal")
+    except Exception as e:
+        log.warning("Gagal kirim balasan ke %s: %s", d['target'], e)
+        await m.reply(f"❌ Gagal: {e}")
     await state.clear()
 
 @dp.callback_query(F.data == "set_post")
@@ -415,36 +1647,598 @@ async def btn_set_prev(c: CallbackQuery, state: FSMContext):
 async def save_preview(m: Message, state: FSMContext):
     await set_config("preview_msg_id", str(m.message_id)); await m.reply("✅ OK."); await state.clear()
 
-@dp.callback_query(F.data == "menu_broadcast", F.from_user.id == OWNER_ID)
+@dp.callback_query(F.data == "menu_broadcast", is_owner)
 async def broadcast_cb(c: CallbackQuery, state: FSMContext):
+    # Tampilin dulu job yang masih jalan biar bisa dipantau/dicancel
+    for job_id in list(broadcaster.tasks):
+        job = await broadcaster.get_job(job_id)
+        if job and job["bot_id"] == tenant().id: await c.message.answer(Broadcaster.progress_text(job), reply_markup=Broadcaster.progress_kb(job))
     await c.message.answer("Kirim BC:"); await state.set_state(AdminStates.waiting_for_broadcast)
 
-@dp.message(AdminStates.waiting_for_broadcast, F.from_user.id == OWNER_ID)
+@dp.message(AdminStates.waiting_for_broadcast, is_owner)
 async def process_broadcast(m: Message, state: FSMContext):
-    count = 0
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT user_id FROM users") as cur:
-            async for row in cur:
-                try: await m.copy_to(row[0]); count += 1; await asyncio.sleep(0.05)
-                except: pass
-    await m.reply(f"✅ Terkirim ke {count} user."); await state.clear()
+    progress = await m.reply("📡 Menyiapkan broadcast...")
+    await broadcaster.start_job(tenant().id, m.chat.id, m.message_id, progress.chat.id, progress.message_id)
+    await state.clear()
+
+@dp.callback_query(F.data.startswith("bc_status:"), is_owner)
+async def broadcast_status_cb(c: CallbackQuery):
+    job = await broadcaster.get_job(int(c.data.split(":")[1]))
+    if not job or job["bot_id"] != tenant().id: return await c.answer("Job ga ketemu.")
+    try: await c.message.edit_text(Broadcaster.progress_text(job), reply_markup=Broadcaster.progress_kb(job))
+    except Exception: pass
+    await c.answer()
+
+@dp.callback_query(F.data.startswith("bc_cancel:"), is_owner)
+async def broadcast_cancel_cb(c: CallbackQuery):
+    job = await broadcaster.get_job(int(c.data.split(":")[1]))
+    if not job or job["bot_id"] != tenant().id: return await c.answer("Job ga ketemu.")
+    await broadcaster.cancel(job["id"])
+    job = await broadcaster.get_job(job["id"])
+    if job:
+        try: await c.message.edit_text(Broadcaster.progress_text(job), reply_markup=Broadcaster.progress_kb(job))
+        except Exception: pass
+    await c.answer("⛔ Dicancel.")
 
 @dp.message(Command("resetfsub"))
 async def reset_fsub_darurat(m: Message):
     if not await is_admin(m.from_user.id): return
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("DELETE FROM config WHERE key='fsub_channels'")
-        await db.commit()
+    await database.execute("DELETE FROM config WHERE bot_id=? AND key='fsub_channels'", (tenant().id,))
+    cache.set_config(tenant().id, "fsub_channels", None)
     await m.reply("✅ **FSUB DIBERSIHKAN TOTAL!**\nSekarang fsub kosong. Silahkan set ulang lewat /panel dengan bener.")
 
+@dp.message(Command("cache"))
+async def cache_stats(m: Message):
+    if not await is_admin(m.from_user.id): return
+    lines = [f"`{name}`: hit {hit} / miss {miss}" for name, (hit, miss) in cache.stats().items()]
+    await m.reply("📊 **CACHE**\n" + "\n".join(lines) + f"\nMedia cached: {len(cache.media)}")
+
+@dp.chat_member()
+async def on_chat_member_update(update: ChatMemberUpdated):
+    # Cuma masuk kalau bot admin di channel; langsung update cache join-nya
+    if not update.chat.username: return
+    joined = update.new_chat_member.status in JOINED_STATUSES
+    membership_cache.set(update.new_chat_member.user.id, update.chat.username, joined)
+
 @dp.callback_query(F.data == "close_panel")
 async def close_panel(c: CallbackQuery): await c.message.delete()
 
+# ================= WEBHOOK SERVER =================
+class WebhookServer:
+    """Terima update via aiohttp, antre di queue terbatas, diproses sama beberapa worker."""
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.worker_count = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.draining = False
+        self._workers = []
+        self._runner = None
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        # Bot clone: satu endpoint, dibedain pake id bot di path
+        app.router.add_post(self.path + "/{bot_id:\\d+}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request):
+        if not hmac.compare_digest(request.headers.get(self.SECRET_HEADER, "").encode(), self.secret.encode()):
+            return web.Response(status=401)
+        if self.draining:
+            return web.Response(status=503)
+        target = self.bot
+        if "bot_id" in request.match_info:
+            clone = tenants.get(int(request.match_info["bot_id"]))
+            if clone is None: return web.Response(status=404)
+            target = clone.bot
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": target})
+        except Exception:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((target, update))
+        except asyncio.QueueFull:
+            # Antrean penuh: Telegram bakal kirim ulang nanti
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            target, update = await self.queue.get()
+            try:
+                await self.dispatcher.feed_update(target, update)
+            except Exception:
+                log.exception("Gagal proses update %s", update.update_id)
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self, timeout: float = 30):
+        """Tolak update baru, habisin antrean dulu, baru matiin worker & server."""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Drain webhook timeout, %d update dibuang", self.queue.qsize())
+        for task in self._workers: task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        if self._runner: await self._runner.cleanup()
+
+    async def run(self):
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+        await self.start()
+        try:
+            await self.bot.set_webhook(f"{WEBHOOK_URL}{self.path}", secret_token=self.secret, drop_pending_updates=True,
+                                       allowed_updates=self.dispatcher.resolve_used_update_types())
+            await stop_event.wait()
+        finally:
+            await self.stop()
+
+# ================= CLONE BOTS =================
+class CloneManager:
+    """Jalanin semua bot aktif di tabel clone_bots dalam proses ini (dispatcher, pool DB & session HTTP dibagi)."""
+
+    POLL_TIMEOUT = 25
+
+    def __init__(self, sync_interval: float = CLONE_SYNC_INTERVAL):
+        self.sync_interval = sync_interval
+        self.pollers = {}
+        # Token yang ditolak Telegram, dilewatin sampai barisnya diganti
+        self.failed = set()
+        self._handling = set()
+        self._task = None
+        # Long-poll tiap clone megang 1 koneksi hampir terus; dipisah dari session kirim (limit 100 koneksi)
+        # biar ratusan clone ga ngabisin slot buat send*/getChatMember. limit=0 = ga dibatesin, jumlahnya = jumlah clone.
+        self.poll_session = AiohttpSession(api=session.api, limit=0)
+
+    @property
+    def webhook(self):
+        return bool(WEBHOOK_URL)
+
+    async def active_rows(self):
+        # expire_date format SQLite (UTC 'YYYY-MM-DD HH:MM:SS'); NULL = ga ada expired
+        return await database.fetchall(
+            "SELECT owner_id, bot_token FROM clone_bots WHERE bot_token IS NOT NULL "
+            "AND (expire_date IS NULL OR datetime(expire_date) > datetime('now'))")
+
+    async def sync(self):
+        wanted = {}
+        for owner_id, token in await self.active_rows():
+            try: clone = Bot(token=token, session=bot.session, default=bot.default)
+            except Exception:
+                continue
+            if clone.id != bot.id and token not in self.failed: wanted[clone.id] = (owner_id, clone)
+        for bot_id in [b for b in tenants if b != MAIN_TENANT_ID]:
+            if bot_id not in wanted or tenants[bot_id].bot.token != wanted[bot_id][1].token:
+                await self.remove(bot_id)
+        for bot_id, (owner_id, clone) in wanted.items():
+            if bot_id in tenants: tenants[bot_id].owner_id = owner_id
+            else: await self.add(Tenant(bot_id, clone, owner_id))
+
+    async def add(self, t: Tenant):
+        tenants[t.id] = t
+        try:
+            if self.webhook:
+                await t.bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}/{t.id}", secret_token=WEBHOOK_SECRET,
+                                        drop_pending_updates=True, allowed_updates=dp.resolve_used_update_types())
+            else:
+                await t.bot.delete_webhook(drop_pending_updates=True)
+                self.pollers[t.id] = asyncio.create_task(self._poll(t))
+        except TelegramUnauthorizedError:
+            log.warning("Token bot clone %s ditolak Telegram", t.id)
+            self.failed.add(t.bot.token)
+            self._drop(t.id)
+        except Exception:
+            # Gagal sementara (jaringan dll), dicoba lagi pas sync berikutnya
+            log.exception("Gagal nyalain bot clone %s", t.id)
+            self._drop(t.id)
+
+    def _drop(self, bot_id: int):
+        tenants.pop(bot_id, None)
+        cache.clear(bot_id)
+        return self.pollers.pop(bot_id, None)
+
+    async def remove(self, bot_id: int):
+        t = tenants.get(bot_id)
+        poller = self._drop(bot_id)
+        if poller:
+            poller.cancel()
+            await asyncio.gather(poller, return_exceptions=True)
+        if t and self.webhook:
+            try: await t.bot.delete_webhook()
+            except Exception: pass
+
+    async def _handle(self, t: Tenant, update: Update):
+        try:
+            await dp.feed_update(t.bot, update)
+        except Exception:
+            log.exception("Gagal proses update %s (bot %s)", update.update_id, t.id)
+
+    async def _poll(self, t: Tenant):
+        offset, delay = None, 1
+        allowed = dp.resolve_used_update_types()
+        while True:
+            try:
+                updates = await self.poll_session(t.bot, GetUpdates(offset=offset, timeout=self.POLL_TIMEOUT, allowed_updates=allowed))
+            except TelegramUnauthorizedError:
+                log.warning("Token bot clone %s ditolak Telegram, dicopot", t.id)
+                self.failed.add(t.bot.token)
+                self._drop(t.id)
+                return
+            except Exception as e:
+                log.warning("Polling bot clone %s gagal: %s", t.id, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                continue
+            delay = 1
+            for update in updates:
+                offset = update.update_id + 1
+                task = asyncio.create_task(self._handle(t, update))
+                self._handling.add(task)
+                task.add_done_callback(self._handling.discard)
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+                await broadcaster.resume()
+            except Exception:
+                log.exception("Gagal sync bot clone")
+
+    async def start(self):
+        await self.sync()
+        if self._task is None:
+            self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for bot_id in [b for b in tenants if b != MAIN_TENANT_ID]:
+            await self.remove(bot_id)
+        if self._handling:
+            await asyncio.wait(self._handling, timeout=10)
+        await self.poll_session.close()
+
+clones = CloneManager()
+
+# ================= PAYMENT GATEWAY =================
+# Status dari provider yang artinya lunas
+PAID_STATUSES = {"paid", "settlement", "success", "completed"}
+
+async def create_invoice(user_id: int, amount: int = None, clone_id: str = None, days: int = None) -> str:
+    """Invoice baru status 'pending'. `clone_id` diisi kalau bayarnya buat perpanjang bot clone `days` hari."""
+    invoice_id = "INV" + uuid.uuid4().hex[:12].upper()
+    await database.execute(
+        "INSERT INTO invoices (id, user_id, bot_id, amount, status, clone_id, days) VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+        (invoice_id, user_id, str(tenant().id), amount, clone_id, days))
+    return invoice_id
+
+class PaymentProcessor:
+    """Callback payment: langsung di-ack, masuk antrean, diproses worker per batch (dedupe per invoice)."""
+
+    # HMAC-SHA256 (hex) dari body mentah pake PAYMENT_SECRET, dihitung provider
+    SIGNATURE_HEADER = "X-Callback-Signature"
+
+    def __init__(self, path: str = PAYMENT_PATH, secret: str = PAYMENT_SECRET, queue_size: int = PAYMENT_QUEUE_SIZE,
+                 workers: int = PAYMENT_WORKERS, batch_size: int = 200):
+        self.path = path
+        self.secret = secret
+        self.worker_count = workers
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._workers = []
+        self._runner = None
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    def sign(self, body: bytes) -> str:
+        return hmac.new(self.secret.encode(), body, hashlib.sha256).hexdigest()
+
+    async def handle(self, request: web.Request):
+        body = await request.read()
+        # Signature nutup seluruh payload, jadi amount/status ga bisa dipalsuin
+        if not self.secret or not hmac.compare_digest(request.headers.get(self.SIGNATURE_HEADER, "").encode(), self.sign(body).encode()):
+            return web.Response(status=401)
+        raw = body.decode("utf-8", "replace")
+        try:
+            data = json.loads(raw)
+            invoice_id = str(data["invoice_id"])
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait((invoice_id, data, raw))
+        except asyncio.QueueFull:
+            # Provider bakal retry
+            return web.Response(status=503)
+        metrics.inc("bot_payment_callbacks_total")
+        return web.json_response({"ok": True})
+
+    async def _worker(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.process(batch)
+            except Exception:
+                log.exception("Gagal proses %d callback payment", len(batch))
+            finally:
+                for _ in batch: self.queue.task_done()
+
+    @staticmethod
+    def _status(data, price):
+        status = str(data.get("status") or "unknown").lower()
+        if status not in PAID_STATUSES: return status
+        try: amount = float(data.get("amount"))
+        except (TypeError, ValueError): amount = None
+        return "underpaid" if price and (amount is None or amount < price) else "paid"
+
+    async def process(self, batch):
+        # Callback dobel (retry provider) cukup diproses sekali per invoice, semua callback-nya dinilai dulu
+        callbacks = defaultdict(list)
+        for invoice_id, data, _ in batch:
+            callbacks[invoice_id].append(data)
+        paid = []
+        async with database.write() as db:
+            await db.executemany("INSERT INTO payment_logs (invoice_id, raw_data) VALUES (?, ?)",
+                                 [(invoice_id, raw) for invoice_id, _, raw in batch])
+            for invoice_id, datas in callbacks.items():
+                async with db.execute("SELECT user_id, bot_id, amount, status, clone_id, days FROM invoices WHERE id=?",
+                                      (invoice_id,)) as cur:
+                    row = await cur.fetchone()
+                if row is None:
+                    log.warning("Callback payment buat invoice ga dikenal: %s", invoice_id)
+                    continue
+                user_id, bot_id, price, current, clone_id, days = row
+                # Udah lunas di batch sebelumnya: status ga boleh mundur, expire ga boleh nambah 2x
+                if current == "paid": continue
+                # Lunas kalau ada satu callback yang nominalnya cukup; underpaid cuma kalau ga ada sama sekali
+                statuses = [self._status(data, price) for data in datas]
+                status = next((s for s in ("paid", "underpaid") if s in statuses), statuses[-1])
+                await db.execute("UPDATE invoices SET status=?, paid_at=CASE WHEN ?='paid' THEN CURRENT_TIMESTAMP END WHERE id=?",
+                                 (status, status, invoice_id))
+                metrics.inc("bot_payment_invoices_total", status=status)
+                if status != "paid": continue
+                expire = None
+                if clone_id:
+                    # expire_date NULL = clone permanen, ga usah diperpanjang
+                    await db.execute(
+                        "UPDATE clone_bots SET expire_date=datetime(max(datetime('now'), coalesce(datetime(expire_date), datetime('now'))), ?) "
+                        "WHERE id=? AND expire_date IS NOT NULL", (f"+{days or 30} days", clone_id))
+                    async with db.execute("SELECT expire_date FROM clone_bots WHERE id=?", (clone_id,)) as cur:
+                        expire = ((await cur.fetchone()) or (None,))[0]
+                paid.append((invoice_id, user_id, bot_id, clone_id, expire))
+        if any(clone_id for _, _, _, clone_id, _ in paid): await clones.sync()
+        await asyncio.gather(*(self.notify(*p) for p in paid), return_exceptions=True)
+
+    async def notify(self, invoice_id, user_id, bot_id, clone_id, expire):
+        t = tenants.get(int(bot_id)) if str(bot_id).isdigit() else None
+        t = t or main_tenant
+        try:
+            if clone_id:
+                await t.bot.send_message(user_id, f"✅ **PEMBAYARAN DITERIMA**\nInvoice: `{invoice_id}`\nBot clone aktif sampai `{expire}` UTC")
+                return
+            await t.bot.send_message(user_id, f"✅ **PEMBAYARAN DITERIMA**\nInvoice: `{invoice_id}`\nAdmin bakal kirim akses VIP-nya.")
+            await t.bot.send_message(t.owner_id, f"💎 **VIP LUNAS: {user_id}**\nInvoice: `{invoice_id}`",
+                                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="🔑 REPLY", callback_data=f"reply:{user_id}")]]))
+        except Exception:
+            log.exception("Gagal kirim notif invoice %s", invoice_id)
+
+    async def start(self, host: str = PAYMENT_HOST, port: int = PAYMENT_PORT):
+        if not self.secret:
+            # Tanpa secret siapa aja bisa nandain invoice lunas
+            log.warning("PAYMENT_SECRET kosong, endpoint callback payment ga dinyalain")
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self, timeout: float = 30):
+        """Matiin server dulu (callback baru ditolak), habisin antrean, baru matiin worker."""
+        if self._runner: await self._runner.cleanup()
+        self._runner = None
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("Drain payment timeout, %d callback belum diproses", self.queue.qsize())
+        for task in self._workers: task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+payments = PaymentProcessor()
+
+# ================= METRICS SERVER =================
+def collect_runtime():
+    for table, (hit, miss) in cache.stats().items():
+        yield "bot_cache_hits_total", "counter", {"table": table}, hit
+        yield "bot_cache_misses_total", "counter", {"table": table}, miss
+    yield "bot_users_pending", "gauge", {}, len(user_registry.pending)
+    yield "bot_broadcast_jobs_running", "gauge", {}, len(broadcaster.tasks)
+    yield "bot_clones_running", "gauge", {}, len(tenants) - 1
+    yield "bot_payment_queue_size", "gauge", {}, payments.queue.qsize()
+
+metrics.collectors.append(collect_runtime)
+
+async def metrics_handler(request: web.Request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    if not METRICS_PORT: return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    return runner
+
+# ================= MIGRATIONS =================
+async def migrate_base(db):
+    # Skema awal; semua IF NOT EXISTS, jadi DB lama (user_version 0) ikut ke-upgrade
+    await init_db(db)
+    await init_payment_db(db)
+    await init_broadcast_db(db)
+    await init_fsm_db(db)
+    await init_tenant_db(db)
+
+async def migrate_indexes(db):
+    for sql in (
+        "CREATE INDEX IF NOT EXISTS idx_invoices_user_status ON invoices (user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_payment_logs_invoice ON payment_logs (invoice_id)",
+        "CREATE INDEX IF NOT EXISTS idx_clone_bots_owner_expire ON clone_bots (owner_id, expire_date)",
+        "CREATE INDEX IF NOT EXISTS idx_titles_bot ON titles (bot_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status)",
+        "CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm (updated_at)",
+    ):
+        await db.execute(sql)
+
+# Urutan = nomor versi (user_version). Migrasi baru SELALU ditambah di belakang, jangan diubah/dihapus.
+async def migrate_invoice_target(db):
+    # Invoice perpanjang bot clone: clone_bots.id yang diperpanjang & berapa hari
+    await db.execute("ALTER TABLE invoices ADD COLUMN clone_id TEXT")
+    await db.execute("ALTER TABLE invoices ADD COLUMN days INTEGER")
+    await db.execute("ALTER TABLE invoices ADD COLUMN paid_at TIMESTAMP")
+
+async def migrate_search(db):
+    # media dibikin ulang: butuh INTEGER PRIMARY KEY (rowid stabil habis VACUUM) buat FTS + link ke judul
+    await db.execute("CREATE TABLE media_new (id INTEGER PRIMARY KEY, code TEXT NOT NULL UNIQUE, file_id TEXT, type TEXT, "
+                     "caption TEXT, bot_id INTEGER NOT NULL DEFAULT 0, title_id INTEGER)")
+    await db.execute("INSERT INTO media_new (code, file_id, type, caption, bot_id) "
+                     "SELECT code, file_id, type, caption, bot_id FROM media ORDER BY rowid")
+    await db.execute("DROP TABLE media")
+    await db.execute("ALTER TABLE media_new RENAME TO media")
+    await db.execute("CREATE INDEX idx_media_title ON media (title_id, id)")
+    # Index FTS5 external content, disinkronin trigger
+    for table, column in (("titles", "title"), ("media", "caption")):
+        await db.execute(f"CREATE VIRTUAL TABLE {table}_fts USING fts5({column}, content='{table}', content_rowid='id', "
+                         "tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+        await db.execute(f"CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table} BEGIN "
+                         f"INSERT INTO {table}_fts (rowid, {column}) VALUES (new.id, new.{column}); END")
+        await db.execute(f"CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table} BEGIN "
+                         f"INSERT INTO {table}_fts ({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column}); END")
+        await db.execute(f"CREATE TRIGGER {table}_fts_au AFTER UPDATE OF {column} ON {table} BEGIN "
+                         f"INSERT INTO {table}_fts ({table}_fts, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                         f"INSERT INTO {table}_fts (rowid, {column}) VALUES (new.id, new.{column}); END")
+        await db.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+
+async def migrate_posts(db):
+    # Satu post = satu seri: judul + urutan kode part
+    await db.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, code TEXT NOT NULL UNIQUE, bot_id INTEGER NOT NULL DEFAULT 0, "
+                     "title_id INTEGER, title TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    await db.execute("CREATE TABLE post_parts (post_id INTEGER NOT NULL, position INTEGER NOT NULL, media_code TEXT NOT NULL, "
+                     "PRIMARY KEY (post_id, position)) WITHOUT ROWID")
+    await db.execute("CREATE INDEX idx_posts_title ON posts (title_id, id)")
+
+MIGRATIONS = (
+    migrate_base,
+    migrate_indexes,
+    migrate_invoice_target,
+    migrate_search,
+    migrate_posts,
+)
+
+async def migrate_db(target=None):
+    """Jalanin migrasi yang belum ke-apply, masing-masing satu transaksi bareng update user_version."""
+    target = target or database
+    async with target.write() as db:
+        async with db.execute("PRAGMA auto_vacuum") as cur: mode = (await cur.fetchone())[0]
+        if mode != 2:
+            # Ganti mode auto_vacuum di DB yang udah ada tabelnya butuh VACUUM penuh (sekali aja)
+            await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            await db.execute("VACUUM")
+        async with db.execute("PRAGMA user_version") as cur: version = (await cur.fetchone())[0]
+    if version > len(MIGRATIONS):
+        raise RuntimeError(f"Skema DB v{version} lebih baru dari kode ini (v{len(MIGRATIONS)})")
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        async with target.write() as db:
+            await db.execute("BEGIN")
+            await migration(db)
+            await db.execute(f"PRAGMA user_version={number}")
+        log.info("Migrasi DB v%d (%s) selesai", number, migration.__name__)
+
+class Vacuum:
+    """Balikin halaman kosong ke OS sedikit-sedikit (auto_vacuum=INCREMENTAL), biar file DB ga bengkak."""
+
+    def __init__(self, interval: float = 3600, pages: int = 2000, threshold: int = 256):
+        self.interval = interval
+        self.pages = pages
+        self.threshold = threshold
+        self._task = None
+
+    async def run(self):
+        free = (await database.fetchone("PRAGMA freelist_count"))[0]
+        if free < self.threshold: return 0
+        async with database.write() as db:
+            # incremental_vacuum bebasin 1 halaman per step; execute() cuma nge-step sekali, executescript jalan sampe selesai
+            await db.executescript(f"PRAGMA incremental_vacuum({self.pages})")
+        freed = min(free, self.pages)
+        metrics.inc("bot_db_vacuum_pages_total", freed)
+        return freed
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try: await self.run()
+            except Exception: log.exception("Incremental vacuum gagal")
+
+    def start(self):
+        if self._task is None: self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+vacuum = Vacuum()
+
 async def main():
-    await init_db()
-    await init_payment_db()
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    await database.start()
+    metrics_runner = await start_metrics_server()
+    try:
+        await migrate_db()
+        fsm_storage.start()
+        vacuum.start()
+        await user_registry.start()
+        await clones.start()
+        await broadcaster.resume()
+        if PAYMENT_PORT: await payments.start()
+        if WEBHOOK_URL:
+            await WebhookServer(dp, bot).run()
+        else:
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot, close_bot_session=False)
+    finally:
+        await payments.stop()
+        await clones.stop()
+        await broadcaster.stop()
+        await user_registry.stop()
+        await fsm_storage.close()
+        await vacuum.stop()
+        await database.close()
+        if metrics_runner: await metrics_runner.cleanup()
+        await bot.session.close()
     
 if __name__ == "__main__":
-    asyncio.run(main()
+    asyncio.run(main())
@@ -0,0 +1,26 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# bot.py baca env pas di-import, jadi harus diset sebelum modul test mana pun import bot
+os.environ.setdefault("BOT_TOKEN", "123456:TESTTESTTESTTESTTESTTESTTESTTESTTEST")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="bottest-"), "test.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+
+
+@pytest.fixture
+def run():
+    """Event loop per test dengan database udah start & dimigrasi; `run(coro)` jalanin coroutine di loop itu."""
+    with asyncio.Runner() as runner:
+        runner.run(bot.database.start())
+        try:
+            runner.run(bot.migrate_db())
+            yield runner.run
+        finally:
+            runner.run(bot.database.close())
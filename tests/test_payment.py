@@ -0,0 +1,23 @@
+import json
+
+import bot
+
+
+async def process(processor, callbacks, price=10_000):
+    async with bot.database.write() as db:
+        await db.execute("DELETE FROM invoices")
+        await db.execute("INSERT INTO invoices (id, user_id, bot_id, amount, status) VALUES ('INV1', 7, '0', ?, 'pending')", (price,))
+    await processor.process([("INV1", data, json.dumps(data)) for data in callbacks])
+    return (await bot.database.fetchone("SELECT status FROM invoices WHERE id='INV1'"))[0]
+
+
+def test_full_amount_retry_wins_over_earlier_underpaid_callback(run, monkeypatch):
+    processor = bot.PaymentProcessor(secret="s")
+    notified = []
+    async def notify(*args): notified.append(args[0])
+    monkeypatch.setattr(processor, "notify", notify)
+    short = {"invoice_id": "INV1", "status": "settlement", "amount": 5_000}
+    full = dict(short, amount=10_000)
+    assert run(process(processor, [short, full])) == "paid"
+    assert notified == ["INV1"]
+    assert run(process(processor, [short, {"invoice_id": "INV1", "status": "pending"}])) == "underpaid"
@@ -0,0 +1,11 @@
+import asyncio
+
+import bot
+
+
+def test_sub_one_rate_bucket_still_grants_a_token():
+    # Rate grup default 20/60 < 1: tanpa capacity eksplisit bucket dulu ga pernah keisi 1 token
+    bucket = bot.TokenBucket(20 / 60)
+    assert bucket.capacity == 1
+    assert bucket.try_acquire()
+    asyncio.run(asyncio.wait_for(bot.TokenBucket(0.5).acquire(), 1))
@@ -0,0 +1,43 @@
+import bot
+
+
+async def seed(title="Naruto Shippuden", caption="Naruto ep 1"):
+    async with bot.database.write() as db:
+        await db.execute("DELETE FROM media")
+        await db.execute("DELETE FROM titles")
+        async with db.execute("INSERT INTO titles (title, bot_id) VALUES (?, 0)", (title,)) as cur:
+            title_id = cur.lastrowid
+        # Judul tanpa post: link judul = code part pertama, sama kayak hasil caption-nya
+        await db.execute("INSERT INTO media (code, file_id, type, caption, bot_id, title_id) "
+                         "VALUES ('abc123', 'f1', 'video', ?, 0, ?)", (caption, title_id))
+
+
+def test_title_and_caption_hit_on_same_code_get_unique_ids(run):
+    run(seed())
+    rows, cursor = run(bot.search_catalog(0, "naruto"))
+    assert [row[3] for row in rows] == ["abc123", "abc123"]
+    assert cursor == ""
+    ids = [result.id for result in bot.inline_results(rows, "testbot")]
+    assert ids[0].startswith("t") and ids[1].startswith("m")
+    assert len(set(ids)) == len(ids)
+
+
+def test_cursor_pages_by_kind_and_row_id(run):
+    run(seed())
+    rows, _ = run(bot.search_catalog(0, "naruto"))
+    title_id = rows[0][0][1:]
+    # Halaman berikutnya habis judul: mulai dari judul dengan id lebih kecil, jadi sisanya cuma caption
+    rows, _ = run(bot.search_catalog(0, "naruto", f"t:{title_id}"))
+    assert [row[0][0] for row in rows] == ["m"]
+
+
+def test_results_bold_raw_titles_with_entities(run):
+    # Nama file asli di katalog: `_` ganjil & `[` telanjang, bikin parse Markdown Telegram gagal
+    title = "[NekoPoi]_Naruto_wa_-_03_[720P]"
+    run(seed(title, title))
+    rows, _ = run(bot.search_catalog(0, "naruto"))
+    for result in bot.inline_results(rows, "testbot"):
+        content = result.input_message_content
+        assert content.parse_mode is None
+        assert content.message_text == f"🎬 {title}"
+        assert [(e.type, e.offset, e.length) for e in content.entities] == [("bold", 3, len(title))]
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+from aiogram.exceptions import TelegramBadRequest
+
+import bot
+
+CAPTION = "[NekoPoi]_Kimi_wa_-_03_[720P]"
+
+
+class FakeBot:
+    def __init__(self):
+        self.albums = []
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        self.albums.append(media)
+        if len(self.albums) == 1: raise TelegramBadRequest(method=None, message="wrong file identifier")
+
+    async def send_video(self, chat_id, file_id, **kwargs):
+        self.albums.append([kwargs])
+
+
+async def seed(parts):
+    async with bot.database.write() as db:
+        await db.execute("DELETE FROM media")
+        await db.execute("DELETE FROM posts")
+        await db.execute("DELETE FROM post_parts")
+        await db.executemany("INSERT INTO media (code, file_id, type, caption, bot_id) VALUES (?, ?, 'video', ?, 0)",
+                             [(f"p{i}", f"f{i}", CAPTION) for i in range(parts)])
+        async with db.execute("INSERT INTO posts (code, bot_id, title) VALUES ('abc', 0, 'x')") as cur:
+            post_id = cur.lastrowid
+        await db.executemany("INSERT INTO post_parts (post_id, position, media_code) VALUES (?, ?, ?)",
+                             [(post_id, i, f"p{i}") for i in range(parts)])
+
+
+def test_failed_album_does_not_stop_remaining_batches(run):
+    run(seed(bot.SERIES_BATCH * 2 + 1))
+    fake = FakeBot()
+    assert run(bot.send_series(SimpleNamespace(bot=fake, chat=SimpleNamespace(id=42)), "abc"))
+    assert [len(album) for album in fake.albums] == [bot.SERIES_BATCH, bot.SERIES_BATCH, 1]
+    # Caption mentah dikirim tanpa parse mode Markdown
+    assert all(item.parse_mode is None for item in fake.albums[1])
+    assert fake.albums[2][0]["parse_mode"] is None